@@ -1,7 +1,11 @@
 """Module pdfsyntax.api: Application Programming Interface"""
 
+import os
 import sys
+import math
+import weakref
 from copy import deepcopy
+from concurrent.futures import ThreadPoolExecutor
 from .docstruct import *
 from .filestruct import *
 from .objects import *
@@ -12,6 +16,8 @@ from .markdown import *
 
 
 METADATA_ATTRS = '/Title /Author /Subject /Keywords /Creator /Producer'.split()
+PAGES_FANOUT = 32
+WRITE_CHUNK = 1024 * 1024
 
 def in2pt(inches: float) -> int:
     """Convert inches into points."""
@@ -40,14 +46,32 @@ PAPER_SIZES = {
 }
 
 
-def doc_constructor(fdata: Callable) -> Doc:
-    """Initialize doc and close first revision."""
-    chrono, nxt, nb = build_xref_sequence(fdata)
-    index = build_index_from_xref_sequence(chrono, nxt, nb)
-    data = [{'eof_cut': eof_cut(i[-1]['abs_pos'], fdata), 'fdata': fdata} for i in index if i[-1]]
+def doc_constructor(fdata: Callable, policy: dict = None, index_cache: dict = None, fingerprint: str = None, mode: str = "SINGLE") -> Doc:
+    """Initialize doc and close first revision.
+
+    policy optionally bounds the object cache, for example {'max_entries': 1000}.
+    index_cache optionally stores the index built for a fingerprinted file
+    on disk, for example {'dir': '/var/cache/pdf', 'max_bytes': 10**8}.
+    mode, the way fdata reads the file (see bdata_provider), is recorded
+    in the data of the revisions read from it.
+    """
+    cached = None
+    if index_cache and fingerprint:
+        cached = read_index_cache(index_cache['dir'], fingerprint)
+    if cached is not None:
+        index, trailer = cached
+    else:
+        chrono, nxt, nb = build_xref_sequence(fdata)
+        index = build_index_from_xref_sequence(chrono, nxt, nb)
+        trailer = None
+        if index_cache and fingerprint:
+            trailer = memoize_obj_in_cache(index, fdata, 0)[0]
+            max_bytes = index_cache.get('max_bytes', INDEX_CACHE_MAX_BYTES)
+            write_index_cache(index_cache['dir'], fingerprint, index, trailer, max_bytes)
+    data = [{'eof_cut': eof_cut(i[-1]['abs_pos'], fdata), 'fdata': fdata, 'mode': mode} for i in index if i[-1]]
     for i in index:
         del i[-1]
-    cache = build_cache(fdata, index)
+    cache = build_cache(fdata, index, policy, trailer)
     doc_initial = Doc(index, cache, data)
     doc_new_rev = commit(doc_initial)
     return doc_new_rev
@@ -59,9 +83,8 @@ def blank(size: str = "A4") -> Doc:
     header = f"%PDF-{VER}".encode('ascii')
     data = [{}]
     data[-1]['fdata'] = bdata_dummy(header)
-    index = [[{}]]
-    index[0][0] = {'o_num': 0, 'o_gen': 0, 'o_ver': 0, 'doc_ver': 0}
-    cache = [None]
+    index = [RevisionIndex([{'o_num': 0, 'o_gen': 0, 'o_ver': 0, 'doc_ver': 0}])]
+    cache = ChunkedList([None])
     doc = Doc(index, cache, data)
     x, y = PAPER_SIZES[size]
     mb = [0, 0, x, y]
@@ -76,56 +99,127 @@ def blank(size: str = "A4") -> Doc:
     return doc
 
 
-def load(file_obj, mode: str = "SINGLE") -> Doc:
+def load(file_obj, mode: str = "SINGLE", policy: dict = None, index_cache: dict = None) -> Doc:
     """Load from file."""
     fdata = bdata_provider(file_obj, mode)
-    return doc_constructor(fdata)
+    fingerprint = file_fingerprint(file_obj, fdata) if index_cache else None
+    return doc_constructor(fdata, policy, index_cache, fingerprint, mode)
 
 
-def loads(bdata) -> Doc:
+def loads(bdata, policy: dict = None) -> Doc:
     """Load from bytes sequence."""
     fdata = bdata_provider(bdata, "SINGLE")
-    return doc_constructor(fdata)
+    return doc_constructor(fdata, policy)
 
 
-def readfile(filename: str) -> Doc:
-    """Read file and initialize doc."""
-    with open(filename, 'rb') as file_obj:
-        doc = load(file_obj, "SINGLE")
+def readfile(filename: str, mode: str = "SINGLE", policy: dict = None, index_cache: dict = None) -> Doc:
+    """Read file and initialize doc.
+
+    In CONTINUOUS mode the file is read on demand, so it is kept open as
+    long as the doc (actually its data provider) is referenced.
+    """
+    if mode != "CONTINUOUS":
+        with open(filename, 'rb') as file_obj:
+            doc = load(file_obj, mode, policy, index_cache)
+        return doc
+    file_obj = open(filename, 'rb')
+    try:
+        doc = load(file_obj, mode, policy, index_cache)
+    except BaseException:
+        file_obj.close()
+        raise
+    weakref.finalize(doc.data[0]['fdata'], file_obj.close)
     return doc
 
 
-def writefile(doc: Doc, filename: str = None) -> Doc:
-    """Write doc into file"""
-    bdata = b''
-    idx = 0
+def dump(doc: Doc, file_obj) -> Doc:
+    """Commit doc and write it into a binary file object, revision by revision.
+
+    The part of the original file that is kept (up to eof_cut) is copied
+    by chunks of WRITE_CHUNK bytes, so that the whole output is never held
+    in memory. Offsets in the new revisions are relative to what is written
+    before them, as computed by commit.
+    """
     doc = commit(doc)
-    nb_rev = len(doc.index)
-    eof_rev = -1
-    for i in range(nb_rev):
-        if 'eof_cut' in doc.data[i]:
-            eof_rev = i
-        else:
-            break
+    eof_rev = original_revisions(doc) - 1
+    pos = 0
     if eof_rev >= 0:
         eof_cut = doc.data[eof_rev]['eof_cut']
-        prov = doc.data[0]['fdata'](0, eof_cut)
-        bdata += prov[0][prov[1]:eof_cut]
-        idx += len(bdata)
-    #else:
-        #FILE_HEADER = b'%PDF-' + version(doc).encode('ascii') + b'\n'
-        #bdata += FILE_HEADER
-        #idx += len(FILE_HEADER)
-    for i in range(eof_rev+1, nb_rev-1):
+        fdata = doc.data[0]['fdata']
+        while pos < eof_cut:
+            bdata, i, _, nb_read = fdata(pos, min(WRITE_CHUNK, eof_cut - pos))
+            if nb_read <= 0:
+                break
+            file_obj.write(memoryview(bdata)[i:i+nb_read])
+            pos += nb_read
+    write_revisions(doc, file_obj, eof_rev + 1)
+    return doc
+
+
+def original_revisions(doc: Doc) -> int:
+    """Return the number of revisions read from the original file."""
+    nb = 0
+    while nb < len(doc.index) and 'eof_cut' in doc.data[nb]:
+        nb += 1
+    return nb
+
+
+def write_revisions(doc: Doc, file_obj, first_rev: int) -> int:
+    """Write the byte streams of committed revisions from first_rev, return the number of bytes."""
+    nb = 0
+    for i in range(first_rev, len(doc.index)-1):
         fragment = doc.data[i]['bdata']
-        bdata += fragment
-        idx += len(fragment)
-    if filename:
-        bfile = open(filename, 'wb')
-        bfile.write(bdata)
-        bfile.close()
+        file_obj.write(fragment)
+        nb += len(fragment)
+    return nb
+
+
+def dump_update(doc: Doc, file_obj) -> Doc:
+    """Commit doc and append only its new revisions to file_obj, opened in r+b mode.
+
+    file_obj must still hold the original file: its size and a hash of its
+    tail are checked against the data the doc was loaded from. New revisions
+    replace what follows the last %%EOF only if it is whitespace, and never
+    make the file shorter if doc reads it through a memory map.
+    """
+    doc = commit(doc)
+    nb_orig = original_revisions(doc)
+    if nb_orig == 0:
+        raise ValueError("Doc was not loaded from a file")
+    fdata = doc.data[0]['fdata']
+    file_obj.seek(0, os.SEEK_END)
+    size = file_obj.tell()
+    if size != bdata_length(fdata) or tail_hash(bdata_provider(file_obj, "CONTINUOUS")) != tail_hash(fdata):
+        raise ValueError("File does not match the data the doc was loaded from")
+    cut = doc.data[nb_orig-1]['eof_cut']
+    if size > cut:
+        bdata, i, _, nb_read = fdata(cut, size - cut)
+        if bytes(bdata[i:i+nb_read]).strip(SPACE):
+            raise ValueError("File has data after its last %%EOF")
+    new_size = cut + sum(len(doc.data[i]['bdata']) for i in range(nb_orig, len(doc.index)-1))
+    if new_size < size and doc.data[0].get('mode') == 'MMAP':
+        raise ValueError("File would shrink while doc reads it through a memory map")
+    file_obj.seek(cut)
+    write_revisions(doc, file_obj, nb_orig)
+    if new_size < size:
+        file_obj.truncate()
+    return doc
+
+
+def writefile(doc: Doc, filename: str = None, append: bool = False) -> Doc:
+    """Write doc into file.
+
+    With append, only the new revisions are added at the end of filename,
+    which must be the file doc was loaded from (see dump_update).
+    """
+    if filename and append:
+        with open(filename, 'r+b') as bfile:
+            doc = dump_update(doc, bfile)
+    elif filename:
+        with open(filename, 'wb') as bfile:
+            doc = dump(doc, bfile)
     else:
-        sys.stdout.buffer.write(bdata)
+        doc = dump(doc, sys.stdout.buffer)
         sys.stdout.buffer.flush()
     return doc
 
@@ -157,11 +251,11 @@ def bool2yesno(b: bool) -> str:
 def metadata(doc: Doc) -> dict:
     """Return doc metadata."""
     ret = {}
-    i = info(doc) or {}
+    i = info(doc, mutable=False) or {}
     for entry in METADATA_ATTRS:
-        ret[entry[1:]] = text_string(get_object(doc, i.get(entry))) or None
-    ret['CreationDate'] = text_string(get_object(doc, i.get('/CreationDate'))) or None
-    ret['ModDate'] = text_string(get_object(doc, i.get('/ModDate'))) or None
+        ret[entry[1:]] = text_string(get_object(doc, i.get(entry), mutable=False)) or None
+    ret['CreationDate'] = text_string(get_object(doc, i.get('/CreationDate'), mutable=False)) or None
+    ret['ModDate'] = text_string(get_object(doc, i.get('/ModDate'), mutable=False)) or None
     return ret 
 
 
@@ -190,47 +284,127 @@ def rotate(doc: Doc, degrees: int = 90, pages: list = []) -> Doc:
         work_pages = pages
     else:
         work_pages = list(range(len(pl)))
+    work_pages = set(work_pages)
     a = [(i ,x[1]) for i, x in enumerate(pl) if i in work_pages]
-    c = flat_page_tree(doc)
-    for nb, old_degrees in a:
-        old_degrees = old_degrees or 0
-        iref = c[nb][0]
-        obj = deepcopy(get_object(doc, iref))
-        obj['/Rotate'] = (old_degrees + degrees) % 360
-        doc = update_object(doc, int(iref.imag), obj)
-    return doc
+    with edit(doc) as session:
+        for nb, old_degrees in a:
+            old_degrees = old_degrees or 0
+            iref = page_ref(doc, nb)
+            obj = session.get(iref)
+            obj['/Rotate'] = (old_degrees + degrees) % 360
+            session.update(int(iref.imag), obj)
+    return session.doc
+
+
+def merge(docs: list) -> Doc:
+    """Concatenate the pages of several docs into a new doc, in one pass.
+
+    Every doc gets a range of object numbers up front and its objects
+    reachable from its pages are renumbered once. The pages, with their
+    inherited attributes, are placed in a new balanced page tree of
+    PAGES_FANOUT kids per node. Document level objects (outlines, forms...)
+    are not carried over.
+    """
+    parts = []
+    nb_pages = 0
+    for doc in docs:
+        nodes, pages = walk_page_tree(doc)
+        excluded = nodes | {int(p.imag) for p, _ in pages}
+        new_pages = [(p_iref, standalone_page(doc, p_iref, inherited)) for p_iref, inherited in pages]
+        deps = page_objects(doc, [p for _, p in new_pages], excluded)
+        parts.append((doc, new_pages, deps))
+        nb_pages += len(pages)
+    nb_nodes = 0
+    n = nb_pages
+    while n > PAGES_FANOUT:
+        n = math.ceil(n / PAGES_FANOUT)
+        nb_nodes += n
+    num = 3 + nb_nodes
+    mappings = []
+    leaves = []
+    for doc, new_pages, deps in parts:
+        mapping = {}
+        for p_iref, _ in new_pages:
+            mapping[p_iref] = complex(0, num)
+            leaves.append(complex(0, num))
+            num += 1
+        for ref in deps:
+            mapping[ref] = complex(0, num)
+            num += 1
+        mappings.append(mapping)
+    nodes = []
+    parent = {}
+    counts = dict.fromkeys(leaves, 1)
+    level = leaves
+    while len(level) > PAGES_FANOUT:
+        next_level = []
+        for i in range(0, len(level), PAGES_FANOUT):
+            node_iref = complex(0, 3 + len(nodes))
+            kids = level[i:i+PAGES_FANOUT]
+            counts[node_iref] = sum(counts[k] for k in kids)
+            nodes.append({'/Type': '/Pages', '/Kids': kids, '/Count': counts[node_iref]})
+            for k in kids:
+                parent[k] = node_iref
+            next_level.append(node_iref)
+        level = next_level
+    for i, node in enumerate(nodes):
+        node['/Parent'] = parent.get(complex(0, 3 + i), 2j)
+    objs = [{'/Type': '/Catalog', '/Pages': 2j}, {'/Type': '/Pages', '/Kids': level, '/Count': nb_pages}]
+    objs += nodes
+    for (doc, new_pages, deps), mapping in zip(parts, mappings):
+        for p_iref, page in new_pages:
+            objs.append({**deep_ref_remap(page, mapping), '/Parent': parent.get(mapping[p_iref], 2j)})
+        objs += [deep_ref_remap(get_object(doc, ref, mutable=False), mapping) for ref in deps]
+    ver = max((version(doc) for doc in docs), default='1.4')
+    return build_doc(ver, objs)
 
 
 def list_streams(doc: Doc) -> list:
     """List all in use Streams of doc."""
     ret = []
     for iref in in_use(doc):
-        o = get_object(doc, iref)
+        o = get_object(doc, iref, mutable=False)
         if type(o) == Stream:
             ret.append(int(iref.imag))
     return ret
 
 
-def apply_filter(doc: Doc, streams: list, flt: str = '/FlateDecode') -> Doc:
-    """Force new filter state, for example /FlateDecode."""
-    for o_num in streams:
-        o = doc.obj(o_num)
-        entries = o['entries']
-        if '/Filter' in entries:
-            if entries['/Filter'] == flt:
-                continue
+def reencode_stream(o: Stream, entries: dict) -> Stream:
+    """Decode stream content and encode it again according to entries."""
+    s, length = forge_stream(entries, o['stream'])
+    return s
+
+
+def apply_filter(doc: Doc, streams: list, flt: str = '/FlateDecode', workers: int = None) -> Doc:
+    """Force new filter state, for example /FlateDecode, optionally encoding in a thread pool."""
+    nums, objs, new_entries = [], [], []
+    with edit(doc) as session:
+        for o_num in streams:
+            o = session.doc.obj(o_num, mutable=False)
+            entries = o['entries']
+            if '/Filter' in entries:
+                if entries['/Filter'] == flt:
+                    continue
+                else:
+                    for e in entries['/Filter'].split():
+                        if e not in DECODED_FILTERS:
+                            continue
+            entries = deepcopy(entries)
+            if '/Filter' in entries and flt == '':
+                del entries['/Filter']
             else:
-                for e in entries['/Filter'].split():
-                    if e not in DECODED_FILTERS:
-                        continue
-        entries = deepcopy(entries)
-        if '/Filter' in entries and flt == '':
-            del entries['/Filter']
+                entries['/Filter'] = flt
+            nums.append(o_num)
+            objs.append(o)
+            new_entries.append(entries)
+        if workers and workers > 1 and len(nums) > 1:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                forged = list(executor.map(reencode_stream, objs, new_entries))
         else:
-            entries['/Filter'] = flt
-        s, length = forge_stream(entries, o['stream'])
-        doc = update_object(doc, o_num, s)
-    return doc
+            forged = map(reencode_stream, objs, new_entries)
+        for o_num, s in zip(nums, forged):
+            session.update(o_num, s)
+    return session.doc
 
 
 def add_text_annotation(doc: Doc, page_num: int, text: str, rect: list, opened: bool = False) -> Doc:
@@ -242,20 +416,20 @@ def add_text_annotation(doc: Doc, page_num: int, text: str, rect: list, opened:
         '/Contents': f"({text})",
         '/Open': opened,
     }
-    doc, a_iref = add_object(doc, annot)
-    page_ref, _ = flat_page_tree(doc)[page_num]
-    new_page = deepcopy(get_object(doc, page_ref))
-    if '/Annots' in new_page:
-        annot_obj = new_page['/Annots']
-        new_array = deepcopy(get_object(doc, new_page['/Annots']))
-        new_array.append(a_iref)
-        doc = update_object(doc, int(annot_obj.imag), new_array)
-    else:
-        annot_array = [a_iref]
-        doc, aa_iref = add_object(doc, annot_array)
-        new_page['/Annots'] = aa_iref
-        doc = update_object(doc, int(page_ref.imag), new_page)
-    return doc
+    p_ref = page_ref(doc, page_num)
+    with edit(doc) as session:
+        a_iref = session.add(annot)
+        new_page = session.get(p_ref)
+        if '/Annots' in new_page:
+            annot_obj = new_page['/Annots']
+            new_array = session.get(new_page['/Annots'])
+            new_array.append(a_iref)
+            session.update(int(annot_obj.imag), new_array)
+        else:
+            aa_iref = session.add([a_iref])
+            new_page['/Annots'] = aa_iref
+            session.update(int(p_ref.imag), new_page)
+    return session.doc
 
 
 def fonts(doc: Doc) -> dict:
@@ -297,9 +471,9 @@ def fonts(doc: Doc) -> dict:
     return ret
 
 
-def compress(doc: Doc) -> Doc:
-    """Compress file."""
-    doc = squash(doc)
+def compress(doc: Doc, dedup: bool = False, workers: int = None) -> Doc:
+    """Compress file, optionally merging identical objects and encoding streams in parallel."""
+    doc = squash(doc, dedup)
     v = version(doc)
     if v < '1.5':
         doc = update_version(doc, '1.5')
@@ -315,7 +489,7 @@ def compress(doc: Doc) -> Doc:
         env1 = None
     doc = group_obj_into_stream(doc, env_num = env1)
     s = list_streams(doc)
-    doc = apply_filter(doc, s)
+    doc = apply_filter(doc, s, workers=workers)
     doc = commit(doc)
     return doc
 
@@ -323,12 +497,11 @@ def compress(doc: Doc) -> Doc:
 def get_page_contents(doc: Doc, page_num: int) -> list:
     """List all content streams of a page."""
     ret = []
-    pages = flat_page_tree(doc)
-    i_c = get_object(doc, pages[page_num][0])['/Contents']
+    i_c = get_object(doc, page_ref(doc, page_num), mutable=False)['/Contents']
     if type(i_c) == complex:
         i_c = [i_c]
     for content in i_c:
-        c2 = get_object(doc, content)
+        c2 = get_object(doc, content, mutable=False)
         if type(c2) != list:
             c2 = [c2]
         for content2 in c2:
@@ -475,5 +648,6 @@ Doc.obj = obj
 Doc.rotate = rotate
 Doc.page_layouts = page_layouts
 Doc.flat_page_tree = flat_page_tree
+Doc.page_ref = page_ref
 Doc.pages = pages
 
@@ -43,7 +43,7 @@ COMMANDS = {
         'help': 'Lossless compression',
         'description': '',
         'epilog': '',
-        'arguments': ['input_f', 'output']
+        'arguments': ['input_f', 'output', 'jobs']
         },
     'hexdump': {
         'help': 'Canonical hex and ascii file dump',
@@ -74,6 +74,13 @@ def main():
                                         type=str,
                                         metavar='FILE',
                                         help='output PDF file')
+            elif a == 'jobs':
+                parser_sub.add_argument('-j', '--jobs',
+                                        dest='jobs',
+                                        type=int,
+                                        default=1,
+                                        metavar='N',
+                                        help='number of threads encoding streams')
     args = parser.parse_args()
     if args.command == 'browse':
         browse(args.input_f)
@@ -86,7 +93,7 @@ def main():
     elif args.command == 'text':
         spatial(args.input_f)
     elif args.command == 'compress':
-        compress_file(args.input_f, args.output_f)
+        compress_file(args.input_f, args.output_f, args.jobs)
     elif args.command == 'hexdump':
         hexdump_cli(args.input_f)
 
@@ -425,10 +432,10 @@ def browse(filename: str) -> None:
     return
 
 
-def compress_file(filename: str, output: str) -> None:
-    """Compress file."""
+def compress_file(filename: str, output: str, jobs: int = 1) -> None:
+    """Compress file, encoding streams with jobs threads."""
     doc = readfile(filename)
-    new_doc = compress(doc)
+    new_doc = compress(doc, workers=jobs)
     writefile(new_doc, output)
     return
 
@@ -4,14 +4,19 @@ from typing import Callable
 from .objects import *
 from .filestruct import *
 from .text import *
-from collections import namedtuple
+from collections import namedtuple, OrderedDict
 from copy import deepcopy
+import hashlib
 
 
 EOL = b'\r\n'
 SPACE = EOL + b'\x00\x09\x0c\x20'
 
 INHERITABLE_ATTRS = '/Resources /MediaBox /CropBox /Rotate'.split()
+BACK_LINKS = ('/Parent', '/P')
+NOT_DEDUPLICATED = ('/Catalog', '/Pages', '/Page', '/Annot', '/ObjStm', '/XRef')
+
+CACHE_CHUNK = 1024
 
 
 Doc = namedtuple('Doc', 'index cache data')
@@ -27,11 +32,14 @@ class Doc(Doc):
         return res
 
     def __getitem__(self, key):
-        """Return immutable slice of pages with the square brackets syntax."""
+        """Return immutable slice of pages with the square brackets syntax.
+
+        A single page is returned as a standalone doc (see page_doc), a
+        slice as the doc where the other pages are removed (see keep_pages).
+        """
         n = number_pages(self)
         if type(key) == int:
-            page = key % n
-            pages = {page}
+            return page_doc(self, key % n)
         elif type(key) == slice:
             start, stop, step = key.indices(n)
             pages = set(range(start, stop, step))
@@ -51,22 +59,221 @@ class Doc(Doc):
         new_doc = concat(self, other)
         return new_doc
 
+
+class ChunkedList:
+    """List stored in chunks that are shared with copies until one of them is changed.
+
+    A copy costs one reference per chunk of CACHE_CHUNK items, so that a doc
+    derived by an edit shares almost all its cache with its parent.
+    Each chunk comes with the references found in its objects (see
+    object_refs), shared and cloned along with it and dropped on write.
+    """
+
+    def __init__(self, iterable=()):
+        """Constructor."""
+        self.chunks = []
+        self.owners = []
+        self.edges = []
+        self.size = 0
+        self.token = object()
+        self.page_tree = None #Memoized by page_tree()
+        self.extend(iterable)
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, i):
+        if type(i) == slice:
+            return [self[j] for j in range(*i.indices(self.size))]
+        if i < 0:
+            i += self.size
+        if i < 0 or i >= self.size:
+            raise IndexError('list index out of range')
+        return self.chunks[i // CACHE_CHUNK][i % CACHE_CHUNK]
+
+    def __setitem__(self, i, value):
+        if i < 0:
+            i += self.size
+        if i < 0 or i >= self.size:
+            raise IndexError('list assignment index out of range')
+        if self.page_tree is not None and i in self.page_tree[0]:
+            self.page_tree = None
+        c = i // CACHE_CHUNK
+        if self.owners[c] is not self.token:
+            self.chunks[c] = self.chunks[c][:]
+            self.edges[c] = self.edges[c].copy()
+            self.owners[c] = self.token
+        self.chunks[c][i % CACHE_CHUNK] = value
+        self.edges[c].pop(i % CACHE_CHUNK, None)
+
+    def append(self, value):
+        self.extend((value,))
+
+    def extend(self, iterable):
+        items = list(iterable)
+        i = 0
+        if items and self.size % CACHE_CHUNK:
+            c = len(self.chunks) - 1
+            if self.owners[c] is not self.token:
+                self.chunks[c] = self.chunks[c][:]
+                self.edges[c] = self.edges[c].copy()
+                self.owners[c] = self.token
+            i = CACHE_CHUNK - self.size % CACHE_CHUNK
+            self.chunks[c].extend(items[:i])
+        for j in range(i, len(items), CACHE_CHUNK):
+            self.chunks.append(items[j:j+CACHE_CHUNK])
+            self.owners.append(self.token)
+            self.edges.append({})
+        self.size += len(items)
+
+    def __iadd__(self, other):
+        self.extend(other)
+        return self
+
+    def __iter__(self):
+        for chunk in self.chunks:
+            yield from chunk
+
+    def share(self, other):
+        """Make other a copy of self, both cloning shared chunks on write."""
+        other.chunks = self.chunks[:]
+        other.owners = self.owners[:]
+        other.edges = self.edges[:]
+        other.size = self.size
+        other.page_tree = self.page_tree
+        self.token = object()
+        return other
+
+    def edge(self, i: int) -> set:
+        """Return the memoized references of item i, None if unknown."""
+        return self.edges[i // CACHE_CHUNK].get(i % CACHE_CHUNK)
+
+    def set_edge(self, i: int, refs: set):
+        """Memoize the references of item i, valid until it is written."""
+        self.edges[i // CACHE_CHUNK][i % CACHE_CHUNK] = refs
+
+    def copy(self):
+        """Shallow copy sharing all chunks until they are changed."""
+        return self.share(ChunkedList())
+
+    def __eq__(self, other):
+        if not isinstance(other, (ChunkedList, list)):
+            return NotImplemented
+        return len(self) == len(other) and all(x == y for x, y in zip(self, other))
+
+    def __repr__(self):
+        return repr(list(self))
+
+
+class ObjectCache(ChunkedList):
+    """Cache of parsed objects bounded by a policy, with least recently used eviction.
+
+    Policy keys are max_entries and max_bytes (None means unbounded).
+    Only objects loaded from fdata are tracked, so that an evicted slot can
+    be parsed again on a miss: trailer, catalog and page tree nodes are pinned,
+    and an object stored by another function (an update) is never evicted.
+    """
+
+    def __init__(self, iterable=(), policy=None, stats=None):
+        """Constructor."""
+        super().__init__(iterable)
+        self.policy = policy or {}
+        self.stats = stats if stats is not None else {'hits': 0, 'misses': 0, 'evictions': 0}
+        self.lru = OrderedDict()
+        self.nb_bytes = 0
+
+    def __setitem__(self, key, value):
+        """Store an object that is not evictable."""
+        if key in self.lru:
+            self.nb_bytes -= self.lru.pop(key)
+        super().__setitem__(key, value)
+
+    def copy(self):
+        """Shallow copy sharing chunks, policy and stats."""
+        new_cache = self.share(ObjectCache((), self.policy, self.stats))
+        new_cache.lru = self.lru.copy()
+        new_cache.nb_bytes = self.nb_bytes
+        return new_cache
+
+    def hit(self, key):
+        """Count a hit and refresh the object position in the eviction order."""
+        self.stats['hits'] += 1
+        if key in self.lru:
+            self.lru.move_to_end(key)
+
+    def admit(self, key):
+        """Track an object that was just loaded from fdata."""
+        obj = self[key]
+        if key == 0 or obj is None:
+            return
+        if type(obj) == dict and obj.get('/Type') in ('/Catalog', '/Pages'):
+            return
+        size = object_size(obj) if self.policy.get('max_bytes') is not None else 0
+        self.lru[key] = size
+        self.nb_bytes += size
+
+    def over_limit(self) -> bool:
+        """Check if tracked objects exceed the policy."""
+        max_entries = self.policy.get('max_entries')
+        max_bytes = self.policy.get('max_bytes')
+        if max_entries is not None and len(self.lru) > max_entries:
+            return True
+        if max_bytes is not None and self.nb_bytes > max_bytes:
+            return True
+        return False
+
+    def evict(self, protected=None):
+        """Free the least recently used objects, except protected, until the policy is satisfied."""
+        if protected in self.lru:
+            self.lru.move_to_end(protected)
+        while self.over_limit():
+            key = next(iter(self.lru))
+            if key == protected:
+                break
+            self.nb_bytes -= self.lru.pop(key)
+            super().__setitem__(key, None)
+            self.stats['evictions'] += 1
+
+
+def object_size(obj) -> int:
+    """Estimate the memory footprint of an object in bytes."""
+    if type(obj) == Stream:
+        return len(obj.encoded or b'') + object_size(obj.entries)
+    elif type(obj) == dict:
+        return sum(len(k) + object_size(v) + 16 for k, v in obj.items())
+    elif type(obj) == list:
+        return sum(object_size(v) + 8 for v in obj)
+    elif type(obj) == str or type(obj) == bytes:
+        return len(obj)
+    return 8
+
+
+def cache_stats(doc: Doc) -> dict:
+    """Return hit, miss and eviction counters of a doc cache with a policy."""
+    if type(doc.cache) != ObjectCache:
+        return None
+    stats = dict(doc.cache.stats)
+    stats['entries'] = len(doc.cache.lru)
+    stats['bytes'] = doc.cache.nb_bytes
+    return stats
+
+
+def cache_policy(doc: Doc) -> dict:
+    """Return the policy of a doc cache, None if it is unbounded."""
+    if type(doc.cache) != ObjectCache:
+        return None
+    return doc.cache.policy
+
+
 class DocIterator:
 
     def __init__(self, doc):
         """Constructor."""
-        self.doc = doc
-        self.current = 0
-        self.end = number_pages(doc)
+        self.pages = burst(doc)
 
     def __next__(self):
-        """Iterate over the doc pages."""
-        if self.current < self.end:
-            new_doc = keep_pages(self.doc, self.current)
-            self.current += 1
-            return new_doc
-        else:
-            raise StopIteration
+        """Iterate over the doc pages, as the standalone docs returned by doc[i]."""
+        return next(self.pages)
 
 
 def pprint_index(doc: Doc, compact: bool = False):
@@ -191,14 +398,14 @@ def pprint_data_history(doc: Doc):
 def pprint_page_hierarchy(doc: Doc, iref: complex = None, n: int = 0, level: int = 0, accu: str =''):
     """Pretty print the tree hierarchy of pages."""
     if not iref:
-        cat, cat_iref = catalog(doc)
-        pages = get_object(doc, cat['/Pages'])
-        pcount = get_object(doc, pages['/Count'])
+        cat, cat_iref = catalog(doc, mutable=False)
+        pages = get_object(doc, cat['/Pages'], mutable=False)
+        pcount = get_object(doc, pages['/Count'], mutable=False)
         accu += f"Page count = {pcount}\n"
         iref = cat['/Pages']
         node = pages
     else:
-        node = get_object(doc, iref)
+        node = get_object(doc, iref, mutable=False)
     level += 1
     offset = "    " * level
     if node['/Type'] == '/Pages':
@@ -220,16 +427,33 @@ def memoize_obj_in_cache(idx: list, fdata: Callable, key: int, cache=None, rev=-
 
     cache argument may be:
     - a list that is updated
+    - an ObjectCache that is updated, its policy being applied
     - or None that is replaced with an empty list
     """
     if cache is None:
         cache = (key + 1) * [None]
-    if 'DELETED' in idx[rev][key]:
+    current = idx[rev]
+    if current.field(key, 'DELETED'):
         return cache
+    bounded = type(cache) == ObjectCache
     if  cache[key] != None:
+        if bounded:
+            cache.hit(key)
         return cache
+    if bounded:
+        cache.stats['misses'] += 1
+    loaded = [key]
+
+    def deref(ref):
+        """Resolve an indirect /Length through the index."""
+        num = int(ref.imag)
+        if num == key or num >= len(current) or num >= len(cache):
+            return None
+        memoize_obj_in_cache(idx, fdata, num, cache, rev)
+        return cache[num]
+
     if key == 0:
-        index = idx[rev][key]
+        index = current[key]
         if type(index) != list:
             indexes = [index]
         else:
@@ -239,101 +463,238 @@ def memoize_obj_in_cache(idx: list, fdata: Callable, key: int, cache=None, rev=-
             bdata, a0, _, _ = fdata(index['abs_pos'],
                                     index['abs_next'] - index['abs_pos'])
             i, j, _ = next_token(bdata, a0)
-            if bdata[i:j] == b'trailer':
-                i, j, _ = next_token(bdata, j)
-            else:
-                i, j, _ = next_token(bdata, j)
+            if bdata[i:j] != b'trailer':
                 i, j, _ = next_token(bdata, j)
                 i, j, _ = next_token(bdata, j)
             text = bdata
-            i_obj = parse_obj(text, i)
+            i_obj = parse_obj(text, j)
             if type(i_obj) == Stream:
                 i_obj = i_obj['entries']
             obj.update(i_obj)
         cache[key] = obj    
-    elif 'env_num' not in idx[rev][key]:
-        bdata, a0, _, _ = fdata(idx[rev][key]['abs_pos'],
-                                idx[rev][key]['abs_next'] - idx[rev][key]['abs_pos'])
+    elif current.field(key, 'env_num') is None:
+        abs_pos = current.field(key, 'abs_pos')
+        bdata, a0, _, _ = fdata(abs_pos, current.field(key, 'abs_next') - abs_pos)
         i, j, _ = next_token(bdata, a0)
         i, j, _ = next_token(bdata, j)
         i, j, _ = next_token(bdata, j)
-        i, j, _ = next_token(bdata, j)
         text = bdata
-        obj = parse_obj(text, i)
+        obj = parse_obj(text, j, deref)
         if key == 0 and type(obj) == Stream:
             obj = obj['entries']
         cache[key] = obj    
     else:
-        container = idx[rev][key]['env_num']
-        bdata, a0, _, _ = fdata(idx[rev][container]['abs_pos'],
-                                idx[rev][container]['abs_next'] - idx[rev][container]['abs_pos'])
-        i, j, _ = next_token(bdata, a0)
-        i, j, _ = next_token(bdata, j)
-        i, j, _ = next_token(bdata, j)
-        i, j, _ = next_token(bdata, j) #/ObjStm
-        text = bdata
-        stream_obj = parse_obj(text, i)
+        container = current.field(key, 'env_num')
         if container >= len(cache):
             cache += (container-len(cache)+1) * [None]
-        cache[container] = stream_obj
-        _, _, _, obj_list = parse_object_stream(stream_obj, container)
-        for o_num, embedded_obj, _, _, _ in obj_list:
-            if o_num >= len(cache):
-                cache += (o_num-len(cache)+1) * [None]
-            cache[o_num] = embedded_obj
+        stream_obj = cache[container]
+        if type(stream_obj) != Stream:
+            abs_pos = current.field(container, 'abs_pos')
+            bdata, a0, _, _ = fdata(abs_pos, current.field(container, 'abs_next') - abs_pos)
+            i, j, _ = next_token(bdata, a0)
+            i, j, _ = next_token(bdata, j)
+            i, j, _ = next_token(bdata, j)
+            text = bdata
+            stream_obj = parse_obj(text, j, deref) #/ObjStm
+            if cache[container] is None:
+                cache[container] = stream_obj
+                loaded.append(container)
+        offsets = object_stream_offsets(stream_obj)
+        if key in offsets:
+            cache[key] = parse_obj(stream_obj['stream'], offsets[key])
+        else:
+            _, _, _, obj_list = parse_object_stream(stream_obj, container)
+            for o_num, embedded_obj, _, _, _ in obj_list:
+                if o_num >= len(cache):
+                    cache += (o_num-len(cache)+1) * [None]
+                if o_num != key and cache[o_num] is not None:
+                    continue
+                if o_num < len(current) and current[o_num] and current.field(o_num, 'env_num') != container:
+                    continue
+                cache[o_num] = embedded_obj
+                if o_num != key:
+                    loaded.append(o_num)
+    if bounded:
+        for o_num in loaded:
+            cache.admit(o_num)
+        cache.evict(key)
     return cache
 
 
-def get_object(doc: Doc, obj):
-    """Return raw object or the target of an indirect reference."""
+def get_object(doc: Doc, obj, mutable=True):
+    """Return raw object or the target of an indirect reference.
+
+    With mutable=False, the object shared with the cache is returned without
+    any copy: it is a read-only view that the caller must not change.
+    """
     if isinstance(obj, complex) == True:
         ref = int(obj.imag)
         res = memoize_obj_in_cache(doc.index, doc.data[-1]['fdata'], ref, doc.cache)
-        return deepcopy(res[ref])
-    else: 
+        obj = res[ref]
+    if mutable:
         return deepcopy(obj)
+    return obj
 
 
-def obj(doc: Doc, o_num, o_gen = None):
+def obj(doc: Doc, o_num, o_gen = None, mutable=True):
     """For direct access to an indirect object without reference resolution (see get_object)."""
     if o_gen is None:
         o_gen = doc.index[-1][o_num]['o_gen']
     iref = complex(o_gen, o_num)
-    return get_object(doc, iref)
+    return get_object(doc, iref, mutable)
 
 
-def flat_page_tree(doc: Doc, num=None, inherited={}, max_nb=None) -> list:
-    """Recursively list the pages of a node."""
+def walk_page_tree(doc: Doc, num=None, inherited=None, max_nb=None) -> tuple:
+    """List the pages of a node, with their inherited attributes, in a single walk.
+
+    Return the numbers of the objects the list depends on (trailer, catalog
+    and /Pages nodes) and the list itself, where pages may share the dict
+    of inherited attributes.
+    """
+    nodes = set()
+    if not num:
+        cat, cat_iref = catalog(doc, mutable=False)
+        nodes = {0, int(cat_iref.imag)}
+        num = cat['/Pages']
     accu = []
-    if num:
-        node = get_object(doc, num)
-    else:
-        node = get_object(doc, catalog(doc)[0]['/Pages'])
-    if node['/Type'] == '/Pages':
-        for kid in node['/Kids']:
+    stack = [(num, inherited or {})]
+    while stack:
+        num, attrs = stack.pop()
+        node = get_object(doc, num, mutable=False)
+        if node['/Type'] == '/Pages':
+            if int(num.imag) in nodes: #Loop in the tree
+                continue
+            nodes.add(int(num.imag))
             e = {k: node.get(k) for k in INHERITABLE_ATTRS if node.get(k) is not None}
-            inherited.update(e)
-            accu = accu + flat_page_tree(doc, kid, inherited.copy(), max_nb)
+            if e:
+                attrs = {**attrs, **e}
+            stack.extend((kid, attrs) for kid in reversed(node['/Kids']))
+        elif node['/Type'] == '/Page':
+            accu.append((num, attrs))
             if max_nb is not None and len(accu) == max_nb:
-                return accu
-        return accu
-    elif node['/Type'] == '/Page':
-        return[(num, inherited)]
+                break
+    return nodes, accu
+
+
+def page_tree(doc: Doc, max_nb=None) -> list:
+    """Return the list of pages, memoized in the doc cache until a page tree node changes.
+
+    The list is shared and must not be modified.
+    """
+    cache = doc.cache
+    if not isinstance(cache, ChunkedList):
+        return walk_page_tree(doc, max_nb=max_nb)[1]
+    if cache.page_tree is None:
+        if max_nb is not None:
+            return walk_page_tree(doc, max_nb=max_nb)[1]
+        cache.page_tree = walk_page_tree(doc)
+    if max_nb is not None:
+        return cache.page_tree[1][:max_nb]
+    return cache.page_tree[1]
+
+
+def flat_page_tree(doc: Doc, num=None, inherited=None, max_nb=None) -> list:
+    """List the pages of a node with their inherited attributes.
+
+    The attributes are copies that can be changed without altering the
+    cached objects, each inherited value being copied once for all pages.
+    """
+    if num:
+        accu = walk_page_tree(doc, num, inherited, max_nb)[1]
+    else:
+        accu = page_tree(doc, max_nb)
+    memo = {}
+    return [(num, {k: deepcopy(v, memo) for k, v in attrs.items()}) for num, attrs in accu]
+
 
+def locate_page(doc: Doc, page_num: int) -> tuple:
+    """Find a page by going down the tree, skipping whole subtrees with their /Count.
 
-def build_cache(fdata: Callable, index: list) -> list:
-    """Initialize cache with trailer."""
+    The kids of a node are scanned from the end nearest to the page, so
+    only the nodes on the path and the kids before it are parsed.
+    Return the page reference and its inherited attributes, or None if the
+    tree does not match its /Count entries.
+    """
+    node_ref = catalog(doc, mutable=False)[0]['/Pages']
+    node = get_object(doc, node_ref, mutable=False)
+    count = get_object(doc, node.get('/Count'), mutable=False)
+    if type(count) != int:
+        return None
+    if page_num < 0:
+        page_num += count
+    if page_num < 0 or page_num >= count:
+        raise IndexError('page number out of range')
+    total = count
+    attrs = {}
+    visited = set()
+    while node.get('/Type') == '/Pages':
+        if node_ref in visited or len(visited) > total: #Loop in the tree
+            return None
+        visited.add(node_ref)
+        e = {k: node.get(k) for k in INHERITABLE_ATTRS if node.get(k) is not None}
+        if e:
+            attrs = {**attrs, **e}
+        backward = 2 * page_num >= count
+        k = count - 1 - page_num if backward else page_num
+        for kid in (reversed(node['/Kids']) if backward else node['/Kids']):
+            kid_node = get_object(doc, kid, mutable=False)
+            if type(kid_node) != dict:
+                return None
+            if kid_node.get('/Type') == '/Pages':
+                n = get_object(doc, kid_node.get('/Count'), mutable=False)
+                if type(n) != int:
+                    return None
+            else:
+                n = 1 if kid_node.get('/Type') == '/Page' else 0
+            if k < n:
+                break
+            k -= n
+        else:
+            return None
+        page_num = n - 1 - k if backward else k
+        node_ref, node, count = kid, kid_node, n
+    return node_ref, attrs
+
+
+def descend_page_tree(doc: Doc, page_num: int) -> complex:
+    """Find a page reference with locate_page, None if the tree does not match its /Count entries."""
+    res = locate_page(doc, page_num)
+    return res[0] if res else None
+
+
+def page_ref(doc: Doc, page_num: int) -> complex:
+    """Return the indirect reference of a page from its number.
+
+    Without a memoized page list, the tree is descended instead of flattened.
+    """
+    if not isinstance(doc.cache, ChunkedList) or doc.cache.page_tree is None:
+        ref = descend_page_tree(doc, page_num)
+        if ref is not None:
+            return ref
+    return page_tree(doc)[page_num][0]
+
+
+def build_cache(fdata: Callable, index: list, policy: dict = None, trailer: dict = None) -> list:
+    """Initialize cache with trailer, parsed from fdata unless already known.
+
+    With a policy (see ObjectCache), the cache is bounded.
+    """
     size = len(index[-1])
-    cache = size * [None]
-    memoize_obj_in_cache(index, fdata, 0, cache)
+    if policy is None:
+        cache = ChunkedList(size * [None])
+    else:
+        cache = ObjectCache(size * [None], policy)
+    if trailer is None:
+        memoize_obj_in_cache(index, fdata, 0, cache)
+    else:
+        cache[0] = trailer
     return cache
 
 
 def get_iref(doc: Doc, o_num: int, rev: int=-1) -> complex:
     """Build the relevant indirect reference for o_num in a doc revision."""
-    current = doc.index[rev]
-    if current[o_num]:
-        o_gen = current[o_num]['o_gen']
+    o_gen = doc.index[rev].field(o_num, 'o_gen')
+    if o_gen is not None:
         return complex(o_gen, o_num)
     else:
         return None
@@ -341,13 +702,10 @@ def get_iref(doc: Doc, o_num: int, rev: int=-1) -> complex:
 
 def in_use(doc: Doc, rev: int=-1) -> list:
     """List objects in use (not empty from the start and not deleted)."""
-    res = []
     current = doc.index[rev]
-    for i in range(1, len(current)):
-        iref = get_iref(doc, i, rev)
-        if iref and 'DELETED' not in current[i]:
-            res.append(iref)
-    return res
+    o_gens = current.column('o_gen')
+    deleted = current.column('DELETED')
+    return [complex(o_gens[i], i) for i in range(1, len(current)) if o_gens[i] is not None and not deleted[i]]
 
 
 def changes(doc: Doc, rev: int=-1):
@@ -358,22 +716,27 @@ def changes(doc: Doc, rev: int=-1):
         previous = [None] * len(current)
     else:
         previous = doc.index[rev-1]
-    for i in range(1, len(current)):
-        iref = get_iref(doc, i, rev)
-        if not iref:
+    o_gens = current.column('o_gen')
+    for i in current.unshared(previous):
+        if o_gens[i] is None:
             continue
+        iref = complex(o_gens[i], i)
         if 'xref_stream_num' in current[0] and current[0]['xref_stream_num'] == i:
             continue
         if i > len(previous)-1:
             res.append((iref, 'a'))
-        elif i < len(previous) and previous[i] == current[i]:
+            continue
+        old_entry = previous[i]
+        if old_entry is None:
+            res.append((iref, 'a'))
+            continue
+        new_entry = current[i]
+        if old_entry == new_entry:
             pass
-        elif previous[i] != None and 'DELETED' not in previous[i] and 'DELETED' in current[i]:
+        elif 'DELETED' not in old_entry and 'DELETED' in new_entry:
             res.append((iref, 'd'))
-        elif previous[i] != None and current[i] != previous[i]:
-            res.append((iref, 'u'))
         else:
-            res.append((iref, 'a'))
+            res.append((iref, 'u'))
     return res
 
 
@@ -381,8 +744,8 @@ def envelopes(doc: Doc):
     """Map objects nums belonging to objects streams."""
     res = {}
     current = doc.index[-1]
-    for i, x in enumerate(current):
-        env_num = x.get('env_num')
+    for i in range(1, len(current)):
+        env_num = current.field(i, 'env_num')
         if env_num:
             if env_num not in res:
                 res[env_num] = []
@@ -402,22 +765,25 @@ def group_obj_into_stream(doc: Doc , env_num: int = None, o_nums: set = None):
         chgs = changes(doc)
         o_nums = set([int(iref.imag) for iref, _ in chgs])
     for o in o_nums:
-        x = new_doc.obj(o)
+        x = new_doc.obj(o, mutable=False)
         if type(x) == Stream:
             continue
         elif type(x) == dict and 'Length' in x:
             continue
-        elif current[o]['o_gen'] != 0:
+        elif current.field(o, 'o_gen') != 0:
             continue
         # TODO Add another elif for encryption dict
-        current[o]['env_num'] = env_num
+        entry = dict(current[o])
+        entry['env_num'] = env_num
+        current[o] = entry
     new_doc.cache[env_num] = Stream({'/Type': '/ObjStm'}, b'', b'')
     return new_doc
 
 
 def envelope_objects(doc: Doc):
     """List objects streams that envelope other objects."""
-    return {o.get('env_num') for o in doc.index[-1] if o.get('env_num')}
+    current = doc.index[-1]
+    return {current.field(i, 'env_num') for i in range(1, len(current)) if current.field(i, 'env_num')}
 
 
 def version(doc: Doc) -> str:
@@ -425,7 +791,7 @@ def version(doc: Doc) -> str:
     fdata = doc.data[0]['fdata']
     bdata, a0, _, _ = fdata(5, 3)
     ver = bdata[a0:a0+3]
-    cat, _ = catalog(doc)
+    cat, _ = catalog(doc, mutable=False)
     if '/Version' in cat and cat['/Version'][1:] > ver.decode('ascii'):
             return cat['/Version'][1:]
     return ver.decode('ascii')
@@ -451,14 +817,14 @@ def updates(doc: Doc) -> int:
     return upd
 
 
-def trailer(doc: Doc):
+def trailer(doc: Doc, mutable=True):
     """Return doc trailer dictionary."""
-    return get_object(doc, 0j)
+    return get_object(doc, 0j, mutable)
 
 
 def encrypted(doc: Doc) -> bool:
     """Detect if doc is encrypted."""
-    trail = trailer(doc)
+    trail = trailer(doc, mutable=False)
     encrypt = trail.get('/Encrypt')
     if encrypt:
         return True
@@ -474,34 +840,34 @@ def hybrid(doc: Doc) -> bool:
         return False
 
 
-def catalog(doc: Doc):
+def catalog(doc: Doc, mutable=True):
     """Return doc Root/Catalog dictionary."""
-    root = trailer(doc)['/Root']
-    return get_object(doc, root), root
+    root = trailer(doc, mutable=False)['/Root']
+    return get_object(doc, root, mutable), root
 
 
-def info(doc: Doc):
+def info(doc: Doc, mutable=True):
     """Return doc Info dictionary if present."""
-    trail = trailer(doc)
+    trail = trailer(doc, mutable=False)
     info = trail.get('/Info')
     if info:
-        return get_object(doc, info)
+        return get_object(doc, info, mutable)
 
 
 def number_pages(doc: Doc):
     """Return doc number of pages."""
-    p = get_object(doc, catalog(doc)[0]['/Pages'])
+    p = get_object(doc, catalog(doc, mutable=False)[0]['/Pages'], mutable=False)
     return p['/Count']
 
 
 def pages(doc: Doc, max_nb=None) -> list:
     """List page objects."""
     pl = []
-    for num, in_attr in flat_page_tree(doc, max_nb=max_nb):
-        temp = deepcopy(get_object(doc, num))
+    for num, in_attr in page_tree(doc, max_nb):
+        temp = get_object(doc, num)
         for a in in_attr:
             if a not in temp:
-                temp[a] = in_attr[a]
+                temp[a] = deepcopy(in_attr[a])
         pl.append(temp)
     return pl
 
@@ -585,7 +951,8 @@ def commit(doc: Doc) -> Doc:
             new_doc.data[-1]['fdata'] = new_prov
         new_doc.index[-1] = new_i
     new_doc.data.append({'fdata': new_doc.data[-1]['fdata']})
-    new_v = [new_index0] + [new_doc.index[-1][i] for i in range(1,len(new_doc.index[-1]))] 
+    new_v = new_doc.index[-1].copy()
+    new_v[0] = new_index0
     new_doc.index.append(new_v)
     new_trailer = new_doc.cache[0]
     if type(new_doc.index[-2][0]) == list: #Linearized
@@ -607,9 +974,9 @@ def rewind(doc: Doc) -> Doc:
     objs = in_use(new_doc)
     if 'eof_cut' in new_doc.data[-1]:
         del new_doc.data[-1]['eof_cut']
-    new_doc.cache.extend(build_cache(doc.data[-1]['fdata'], new_doc.index))
+    new_doc = new_doc._replace(cache=build_cache(doc.data[-1]['fdata'], new_doc.index, cache_policy(doc)))
     for o in objs:
-        get_object(new_doc, o)
+        get_object(new_doc, o, mutable=False)
     return new_doc
 
 
@@ -669,6 +1036,65 @@ def add_object(doc: Doc, new_o, immut=True) -> tuple:
     return new_doc, complex(0, num)
 
 
+class EditSession:
+    """Batch of changes applied in place to a single copy of a doc.
+
+    Use it as a context manager through edit(); the resulting doc is
+    available in the doc attribute once the block is left.
+    """
+
+    def __init__(self, doc: Doc):
+        """Constructor."""
+        self.doc = copy_doc(doc, revision='SAME')
+        self.closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.closed = True
+        return False
+
+    def check_open(self):
+        """Refuse changes once the session is over, the doc being shared from then on."""
+        if self.closed:
+            raise ValueError("Edit session is closed")
+
+    def get(self, iref: complex, mutable: bool = True):
+        """Return an object of the doc being edited."""
+        return get_object(self.doc, iref, mutable)
+
+    def update(self, num: int, new_o) -> None:
+        """Replace object num."""
+        self.check_open()
+        update_object(self.doc, num, new_o, immut=False)
+
+    def delete(self, num: int) -> None:
+        """Delete object num."""
+        self.update(num, None)
+
+    def add(self, new_o) -> complex:
+        """Add new object and return its indirect reference."""
+        self.check_open()
+        _, iref = add_object(self.doc, new_o, immut=False)
+        return iref
+
+    def set_trailer(self, trailer: dict) -> None:
+        """Replace the trailer dictionary."""
+        self.check_open()
+        self.doc.cache[0] = trailer
+
+
+def edit(doc: Doc) -> EditSession:
+    """Open an edit session where many objects are changed with a single copy of doc.
+
+    with edit(doc) as session:
+        session.update(num, obj)
+    new_doc = session.doc
+    """
+    return EditSession(doc)
+
+
 def force_xref_stream(doc: Doc, placeholder: bool = False, filt: str = '/FlateDecode') -> tuple:
     """Activate xref stream and optionally add placeholder at the end of current index."""
     if 'xref_stream_num' in doc.index[-1][0]:
@@ -701,19 +1127,17 @@ def concat(doc_left: Doc, doc_right: Doc, target_left: bool = True) -> Doc:
     target_left arg specifies to which doc incremental update is applied
     """
     if target_left:
-        new_doc = copy_doc(doc_left, revision='SAME')
-        source_doc = doc_right
+        target_doc, source_doc = doc_left, doc_right
     else:
-        new_doc = copy_doc(doc_right, revision='SAME')
-        source_doc = doc_left
+        target_doc, source_doc = doc_right, doc_left
     mapping = {}
-    start_num = max_num(new_doc) + 1
-    cat, cat_iref = catalog(new_doc)
+    start_num = max_num(target_doc) + 1
+    cat, cat_iref = catalog(target_doc, mutable=False)
     source_doc = squash(source_doc)
-    source_cat, source_cat_iref = catalog(source_doc)
+    source_cat, source_cat_iref = catalog(source_doc, mutable=False)
     source_pages_iref = source_cat['/Pages']
-    source_pages = get_object(source_doc, source_pages_iref)
-    source_pcount = get_object(source_doc, source_pages['/Count'])
+    source_pages = get_object(source_doc, source_pages_iref, mutable=False)
+    source_pcount = get_object(source_doc, source_pages['/Count'], mutable=False)
     source_doc = update_object(source_doc, int(source_cat_iref.imag), None)
     x_num = source_doc.index[-1][0].get('xref_stream_num')
     if x_num and x_num > 0:
@@ -723,44 +1147,74 @@ def concat(doc_left: Doc, doc_right: Doc, target_left: bool = True) -> Doc:
     for iref in objs:
         mapping[iref] = ir
         ir += 1j
-    for iref in objs:
-        obj = get_object(source_doc, iref)
-        new_obj = deep_ref_retarget(obj, mapping)
-        new_doc, _ = add_object(new_doc, new_obj, immut=False)
-    pages_iref = cat['/Pages']
-    pages = get_object(new_doc, pages_iref)
-    pcount = get_object(new_doc, pages['/Count'])
-    kids = get_object(new_doc, pages['/Kids'])
-    if target_left:
-        kids.append(mapping[source_pages_iref])
+    with edit(target_doc) as session:
+        for iref in objs:
+            obj = get_object(source_doc, iref)
+            session.add(deep_ref_retarget(obj, mapping))
+        pages_iref = cat['/Pages']
+        pages = session.get(pages_iref)
+        pcount = session.get(pages['/Count'], mutable=False)
+        kids = session.get(pages['/Kids'])
+        if target_left:
+            kids.append(mapping[source_pages_iref])
+        else:
+            kids.insert(0, mapping[source_pages_iref])
+        pages['/Kids'] = kids
+        pages['/Count'] = pcount + source_pcount
+        session.update(int(pages_iref.imag), pages)
+    return session.doc
+
+
+def direct_refs(obj: Any) -> set:
+    """List references inside a dict, an array or a stream, except back links to parents."""
+    if type(obj) == dict or type(obj) == list or type(obj) == Stream:
+        return deep_ref_detect(obj, skip=BACK_LINKS)
+    elif type(obj) == complex:
+        return {obj}
+    return set()
+
+
+def object_refs(doc: Doc, iref: complex, graph: dict) -> set:
+    """Return the references inside an indirect object, memoized in graph.
+
+    With a ChunkedList cache, the references are memoized next to the
+    object instead, so that they are shared by the docs sharing the object
+    and dropped when its slot is written (or evicted).
+    """
+    num = int(iref.imag)
+    cache = doc.cache
+    in_cache = isinstance(cache, ChunkedList) and 0 < num < len(cache)
+    refs = cache.edge(num) if in_cache else graph.get(num)
+    if refs is not None:
+        return refs
+    obj = get_object(doc, iref, mutable=False)
+    refs = direct_refs(obj) if type(obj) != complex else set()
+    if in_cache:
+        cache.set_edge(num, refs)
     else:
-        kids.insert(0, mapping[source_pages_iref])
-    pages['/Kids'] = kids
-    pages['/Count'] = pcount + source_pcount
-    new_doc = update_object(new_doc, int(pages_iref.imag), pages, immut=False)
-    return new_doc
+        graph[num] = refs
+    return refs
+
+
+def reachable(doc: Doc, irefs, excluded: set = ()) -> set:
+    """List all indirect objects reachable from irefs, in a single traversal.
+
+    Objects whose number is in excluded are neither listed nor traversed.
+    """
+    graph = {}
+    res = set(irefs)
+    todo = list(res)
+    while todo:
+        for ref in object_refs(doc, todo.pop(), graph):
+            if ref not in res and int(ref.imag) not in excluded:
+                res.add(ref)
+                todo.append(ref)
+    return res
 
 
 def dependencies(doc: Doc, obj: Any) -> set:
     """Recursively list indirect references found inside object.""" 
-    if type(obj) == dict:
-        res = set()
-        for k, v in obj.items():
-            if k == '/Parent' or k == '/P':
-                continue
-            res = res | dependencies(doc, v)
-        return res
-    elif type(obj) == list:
-        res = set()
-        for i in obj:
-            res = res | dependencies(doc, i)
-        return res
-    elif type(obj) == complex:
-        res = {obj}
-        res = res | dependencies(doc, get_object(doc, obj))
-        return res
-    else:   
-        return set()
+    return reachable(doc, direct_refs(obj))
 
 
 def keep_pages(doc: Doc, pages) -> Doc:
@@ -775,33 +1229,114 @@ def keep_pages(doc: Doc, pages) -> Doc:
 
 def remove_pages(doc: Doc, del_pages) -> Doc:
     """Remove one (an int) or more (a set of int) pages."""
-    new_doc = copy_doc(doc, revision='SAME')
     if type(del_pages) != set:
         del_pages = {del_pages}
-    pages = flat_page_tree(new_doc)
+    pages = page_tree(doc)
     del_ref = {pages[p][0] for p in del_pages}
     keep_ref = {p[0] for p in pages} - del_ref
-    del_dep = set()
-    keep_dep = set()
-    for i in del_ref:
-        del_dep = del_dep | dependencies(new_doc, i)
-    for i in keep_ref:
-        keep_dep = keep_dep | dependencies(new_doc, i)
+    del_dep = reachable(doc, del_ref)
+    keep_dep = reachable(doc, keep_ref)
+    parents = {}
+    def parent(ref):
+        if ref not in parents:
+            parents[ref] = get_object(doc, ref, mutable=False).get('/Parent')
+        return parents[ref]
+    removed = {}
+    decrements = {}
     for ref in del_ref:
-        parent = get_object(new_doc, ref)['/Parent']
-        new_parent = get_object(new_doc, parent)
-        kids = new_parent['/Kids']
-        kids.remove(ref)
-        new_parent['/Count'] = new_parent['/Count'] - 1
-        new_doc = update_object(new_doc, int(parent.imag), new_parent, immut=False)
-        while '/Parent' in new_parent:
-            p = new_parent['/Parent']
-            new_parent = get_object(new_doc, p)
-            new_parent['/Count'] = new_parent['/Count'] - 1
-            new_doc = update_object(new_doc, int(p.imag), new_parent, immut=False)
-    for ref in del_dep - keep_dep:
-        new_doc = update_object(new_doc, int(ref.imag), None, immut=False)
-    return new_doc
+        node = parent(ref)
+        removed.setdefault(node, set()).add(ref)
+        while node is not None:
+            decrements[node] = decrements.get(node, 0) + 1
+            node = parent(node)
+    with edit(doc) as session:
+        for node, nb in decrements.items():
+            new_node = session.get(node)
+            if node in removed:
+                new_node['/Kids'] = [k for k in new_node['/Kids'] if k not in removed[node]]
+            new_node['/Count'] = new_node['/Count'] - nb
+            session.update(int(node.imag), new_node)
+        for ref in del_dep - keep_dep:
+            session.delete(int(ref.imag))
+    return session.doc
+
+
+def build_doc(ver: str, objs: list) -> Doc:
+    """Build a doc in a single revision from objects numbered from 1, the first one being the catalog."""
+    header = f"%PDF-{ver}".encode('ascii')
+    index = [RevisionIndex([{'o_num': 0, 'o_gen': 0, 'o_ver': 0, 'doc_ver': 0}])]
+    doc = Doc(index, ChunkedList([None]), [{'fdata': bdata_dummy(header)}])
+    with edit(doc) as session:
+        for o in objs:
+            session.add(o)
+        session.set_trailer({'/Root': 1j})
+    return commit(session.doc)
+
+
+def standalone_page(doc: Doc, page_iref: complex, inherited: dict) -> dict:
+    """Return a read-only page dict completed with its inherited attributes."""
+    page = get_object(doc, page_iref, mutable=False)
+    return {**page, **{k: v for k, v in inherited.items() if k not in page}}
+
+
+def page_objects(doc: Doc, pages: list, excluded: set = ()) -> list:
+    """List the objects reachable from pages, except excluded numbers, in number order.
+
+    The catalog and the page tree objects are neither listed nor traversed.
+    """
+    graph = {}
+    res = set()
+    todo = []
+    for page in pages:
+        todo.extend(direct_refs(page))
+    while todo:
+        ref = todo.pop()
+        if ref in res or int(ref.imag) in excluded:
+            continue
+        o = get_object(doc, ref, mutable=False)
+        if type(o) == dict and o.get('/Type') in ('/Catalog', '/Pages', '/Page'):
+            continue
+        res.add(ref)
+        todo.extend(object_refs(doc, ref, graph))
+    return sorted(res, key=lambda x: (x.imag, x.real))
+
+
+def build_page_doc(doc: Doc, page_iref: complex, inherited: dict, ver: str) -> Doc:
+    """Build a single-page doc from a page of doc, its inherited attributes and the objects it needs, renumbered."""
+    page = standalone_page(doc, page_iref, inherited)
+    deps = page_objects(doc, [page])
+    mapping = {page_iref: 3j}
+    for i, ref in enumerate(deps):
+        mapping[ref] = complex(0, i + 4)
+    objs = [{'/Type': '/Catalog', '/Pages': 2j}, {'/Type': '/Pages', '/Kids': [3j], '/Count': 1}]
+    objs.append({**deep_ref_remap(page, mapping), '/Parent': 2j})
+    objs += [deep_ref_remap(get_object(doc, ref, mutable=False), mapping) for ref in deps]
+    return build_doc(ver, objs)
+
+
+def page_doc(doc: Doc, page_num: int) -> Doc:
+    """Return a page as a standalone single-page doc, the same as burst yields.
+
+    The page is found by going down the tree (see locate_page), so that
+    the rest of the page tree is not parsed.
+    """
+    res = locate_page(doc, page_num)
+    if res is None:
+        res = page_tree(doc)[page_num]
+    return build_page_doc(doc, res[0], res[1], version(doc))
+
+
+def burst(doc: Doc):
+    """Split doc into single-page docs, yielded in page order.
+
+    Each new doc is made of a page, with its inherited attributes, and the
+    objects reachable from it, renumbered. The page tree is walked once
+    and the reference graph of doc is shared by all pages; parsed objects
+    without references are shared with doc.
+    """
+    ver = version(doc)
+    for page_iref, inherited in walk_page_tree(doc)[1]:
+        yield build_page_doc(doc, page_iref, inherited, ver)
 
 
 #def detect_unused(doc: Doc) -> dict:
@@ -816,7 +1351,7 @@ def remove_pages(doc: Doc, del_pages) -> Doc:
 
 def defragment_map(current_index: list, excluded={}) -> tuple:
     """Build new index without excluded slots (ie deleted objects)."""
-    new_index = [{'o_num': 0, 'o_gen': 0, 'o_ver': 0, 'doc_ver': 0}]
+    new_index = RevisionIndex([{'o_num': 0, 'o_gen': 0, 'o_ver': 0, 'doc_ver': 0}])
     mapping = {}
     nb = 0
     for i, o in enumerate(current_index):
@@ -827,7 +1362,7 @@ def defragment_map(current_index: list, excluded={}) -> tuple:
         else:
             nb += 1
             old_ref = complex(o['o_gen'], o['o_num'])
-            new_o = deepcopy(o)
+            new_o = deepcopy(dict(o))
             new_o['o_gen'] = 0
             new_o['o_ver'] = 0
             new_o['doc_ver'] = 0
@@ -843,20 +1378,87 @@ def defragment_map(current_index: list, excluded={}) -> tuple:
     return new_index, mapping
 
 
-def squash(doc: Doc) -> Doc:
-    """Group all revisions into a single one."""
+def duplicate_objects(doc: Doc) -> dict:
+    """Map each duplicate object to the identical object that replaces it.
+
+    Objects are compared through a hash of their serialization, made of
+    entries and encoded bytes for streams. Referenced objects are hashed
+    before the objects referencing them, with references to duplicates
+    already replaced, so that containers of merged objects merge too.
+    Page tree nodes, annotations and objects linked to a parent are kept.
+    """
+    objs = {}
+    for iref in in_use(doc):
+        obj = get_object(doc, iref, mutable=False)
+        d = obj.entries if type(obj) == Stream else obj
+        if type(d) == dict and (d.get('/Type') in NOT_DEDUPLICATED or '/Parent' in d or '/P' in d):
+            continue
+        objs[iref] = obj
+    order = []
+    visited = set()
+    for root in objs:
+        if root in visited:
+            continue
+        visited.add(root)
+        stack = [(root, iter(deep_ref_detect(objs[root])))]
+        while stack:
+            iref, kids = stack[-1]
+            for kid in kids:
+                if kid in objs and kid not in visited:
+                    visited.add(kid)
+                    stack.append((kid, iter(deep_ref_detect(objs[kid]))))
+                    break
+            else:
+                stack.pop()
+                order.append(iref)
+    dups = {}
+    seen = {}
+    for iref in order:
+        obj = objs[iref]
+        if type(obj) == Stream:
+            entries = deep_ref_retarget(deepcopy(obj.entries), dups)
+            key = serialize(entries) + hashlib.sha256(obj.encoded or b'').digest()
+        else:
+            key = serialize(deep_ref_retarget(deepcopy(obj), dups))
+        key = hashlib.sha256(key).digest()
+        if key in seen:
+            dups[iref] = seen[key]
+        else:
+            seen[key] = iref
+    return dups
+
+
+def squash(doc: Doc, dedup: bool = False) -> Doc:
+    """Group all revisions into a single one.
+
+    With dedup, identical objects are merged (see duplicate_objects).
+    """
     obj_stms = envelope_objects(doc)
     if type(doc.index[0][0]) == dict:
         xref_stream_num = doc.index[0][0].get('xref_stream_num')
     else: #TODO
         xref_stream_num = doc.index[0][0][0].get('xref_stream_num')
     old_index = doc.index[-1]
-    new_index, mapping = defragment_map(old_index, set())
+    dups = duplicate_objects(doc) if dedup else {}
+    new_index, mapping = defragment_map(old_index, {int(iref.imag) for iref in dups})
+    for iref, kept in dups.items():
+        mapping[iref] = mapping.get(kept, kept)
+    def renumber(num):
+        old_ref = complex(old_index.field(num, 'o_gen'), num)
+        return int(mapping.get(old_ref, old_ref).imag)
+    for i in range(1, len(new_index)):
+        env_num = new_index.field(i, 'env_num')
+        if env_num:
+            entry = dict(new_index[i])
+            entry['env_num'] = renumber(env_num)
+            new_index[i] = entry
     if xref_stream_num:
+        if xref_stream_num > 0:
+            xref_stream_num = renumber(xref_stream_num)
         new_index[0]['xref_stream_num'] = xref_stream_num
-    new_cache = len(new_index) * [None]
+    new_cache = ChunkedList(len(new_index) * [None])
     new_data = [{}]
-    new_cache[0] = {'/Root': trailer(doc)['/Root']}
+    new_cache[0] = {'/Root': trailer(doc, mutable=False)['/Root']}
     new_cache[0] = deep_ref_retarget(new_cache[0], mapping)
     for i in range(1, len(new_index)):
         old_ref = new_index[i]['OLD_REF']
@@ -914,7 +1516,7 @@ def prepare_widths(widths, first_char):
 def prepare_font(doc: Doc, iref) -> dict:
     """ """
     font_desc = {}
-    o = get_object(doc, iref)
+    o = get_object(doc, iref, mutable=False)
     font_desc['iref'] = iref
     font_desc['name'] = o['/BaseFont']
     font_desc['type'] = o['/Subtype']
@@ -926,13 +1528,14 @@ def prepare_font(doc: Doc, iref) -> dict:
     widths = o.get('/Widths')
     descendant = o.get('/DescendantFonts')
     if widths:
-        font_desc['char_width'] = prepare_widths(get_object(doc, widths), get_object(doc, first_char))
+        font_desc['char_width'] = prepare_widths(get_object(doc, widths, mutable=False),
+                                                 get_object(doc, first_char, mutable=False))
     elif descendant:
-        iref = get_object(doc, descendant)[0]
-        d = get_object(doc, iref)
+        iref = get_object(doc, descendant, mutable=False)[0]
+        d = get_object(doc, iref, mutable=False)
         w = d.get('/W')
         dw = d.get('/DW', 1000)
-        font_desc['char_width'] = prepare_w(get_object(doc, w), get_object(doc, dw))
+        font_desc['char_width'] = prepare_w(get_object(doc, w, mutable=False), get_object(doc, dw, mutable=False))
     else:
         #TODO Find standard fonts widths
         default_widths = [500] * 256
@@ -942,7 +1545,7 @@ def prepare_font(doc: Doc, iref) -> dict:
     else:
         simple = True
     if font_desc['to_unicode']:
-        cmap_stream = get_object(doc, font_desc['to_unicode'])
+        cmap_stream = get_object(doc, font_desc['to_unicode'], mutable=False)
         cmap = parse_obj(b'[' + cmap_stream['stream'] + b']')
         def dec_unicode_cmap(text):
             return apply_tounicode(cmap, text, simple)
@@ -963,10 +1566,9 @@ def get_page_fonts(doc: Doc, page_nums: list) -> list:
     for page_num in page_nums:
         fonts = {}
         font_res = {}
-        page_ref, _ = flat_page_tree(doc)[page_num]
-        resources = get_object(doc, page_ref)['/Resources']
+        resources = get_object(doc, page_ref(doc, page_num), mutable=False)['/Resources']
         if resources:
-            fonts = get_object(doc, resources)['/Font']
+            fonts = get_object(doc, resources, mutable=False)['/Font']
         for font in fonts:
             font_res[font] = prepare_font(doc, fonts[font])
         ret.append(font_res)
@@ -1,17 +1,38 @@
 """Module pdfsyntax.filestruct: how objects are stored in a PDF file"""
 
+from typing import Any
 from typing import Callable
 from typing import IO
 from .objects import *
 import os
+import sys
+import json
 import math
+import mmap
+import hashlib
+from array import array
 from copy import deepcopy
+from collections import OrderedDict
 from .filters import *
 
 MARGIN = b'\n'
 
+#Columns of the index entries, with the typecode of their array
+INDEX_COLUMNS = (('o_num', 'i'), ('o_gen', 'i'), ('o_ver', 'i'), ('doc_ver', 'i'),
+                 ('abs_pos', 'q'), ('abs_next', 'q'), ('env_num', 'i'), ('o_pos', 'i'))
+INDEX_CHUNK = 1024
+#Flags of an index entry, followed by one presence bit per column
+#(with F_EMBEDDED_POS, the abs_pos column holds the position of the object stream)
+F_PRESENT, F_DELETED, F_EMBEDDED_POS, F_RAW = 1, 2, 4, 8
+F_COLUMN = 16
+#On-disk index cache: format version, hashed tail length and default size limit
+INDEX_CACHE_FORMAT = 4
+INDEX_CACHE_TAIL = 65536
+INDEX_CACHE_MAX_BYTES = 64 * 1024 * 1024
+INDEX_CACHE_SUFFIX = '.pdfidx'
 
-def bdata_provider(data_source, mode: str = "SINGLE"):
+
+def bdata_provider(data_source, mode: str = "SINGLE", block_size: int = 4096, cache_blocks: int = 256):
     """Build - with a higher order function - an interface to binary data.
     
     The generated function arguments are:
@@ -22,6 +43,13 @@ def bdata_provider(data_source, mode: str = "SINGLE"):
     - the index into the buffer,
     - the offset from the beginning of the file to the buffer,
     - the number of readable bytes.
+
+    Modes are:
+    - SINGLE: the whole data source is read into memory once
+    - MMAP: the file is memory-mapped and pages are loaded on demand by the OS
+    - CONTINUOUS: the file object is read on demand through an LRU cache of
+      cache_blocks blocks of block_size bytes, adjacent missing blocks being
+      fetched with a single read
     """
     if mode == "SINGLE":
         if type(data_source) == bytes:
@@ -38,11 +66,52 @@ def bdata_provider(data_source, mode: str = "SINGLE"):
                 nb_read = min(len(bdata) - i, length)
             return (bdata, i, 0, nb_read)
         return single_load
+    elif mode == "MMAP":
+        try:
+            bdata = mmap.mmap(data_source.fileno(), 0, access=mmap.ACCESS_READ)
+        except (AttributeError, OSError, ValueError):
+            #Not a regular file (bytes, in-memory stream, empty file...)
+            return bdata_provider(data_source, "SINGLE")
+        def mmap_load(start_pos: int, length: int) -> tuple:
+            if start_pos ==  None and length == -1: #Special escape for length only
+                return (None, None, None, len(bdata))
+            i = (start_pos + len(bdata)) % len(bdata)
+            if length == -1:
+                nb_read = len(bdata) - i
+            else:
+                nb_read = min(len(bdata) - i, length)
+            return (bdata, i, 0, nb_read)
+        return mmap_load
     else:
         file_obj = data_source
+        file_obj.seek(0, os.SEEK_END)
+        file_size = file_obj.tell()
+        blocks = OrderedDict()
+        def read_blocks(first: int, last: int) -> bytes:
+            if last - first + 1 > cache_blocks: #Too big to be cached
+                file_obj.seek(first * block_size)
+                return file_obj.read((last - first + 1) * block_size)
+            parts = []
+            b = first
+            while b <= last:
+                if b in blocks:
+                    blocks.move_to_end(b)
+                    parts.append(blocks[b])
+                    b += 1
+                    continue
+                e = b
+                while e < last and e + 1 not in blocks: #Coalesce adjacent misses
+                    e += 1
+                file_obj.seek(b * block_size)
+                chunk = file_obj.read((e - b + 1) * block_size)
+                for k in range(b, e + 1):
+                    blocks[k] = chunk[(k - b) * block_size:(k - b + 1) * block_size]
+                parts.append(chunk)
+                b = e + 1
+            while len(blocks) > cache_blocks:
+                blocks.popitem(last=False)
+            return b''.join(parts)
         def continuous_load(start_pos: int, length: int) -> tuple:
-            file_obj.seek(0, os.SEEK_END)
-            file_size = file_obj.tell()
             if start_pos == None and length == -1:
                 return (None, None, None, file_size)
             i = (start_pos + file_size) % file_size
@@ -50,9 +119,10 @@ def bdata_provider(data_source, mode: str = "SINGLE"):
                 nb_read = file_size - i
             else:
                 nb_read = min(file_size - i, length)
-            file_obj.seek(i)
-            bdata = file_obj.read(nb_read)
-            return (bdata, i, 0, nb_read)
+            first = i // block_size
+            last = max(first, (i + nb_read - 1) // block_size)
+            bdata = read_blocks(first, last)
+            return (bdata, i - first * block_size, first * block_size, nb_read)
         return continuous_load
 
 
@@ -83,6 +153,19 @@ def bdata_all(bdata: Callable) -> bytes:
     return bdata
 
 
+def bdata_find(fdata: Callable, sub: bytes, start_pos: int, window: int = 4096) -> int:
+    """Return the absolute position of sub after start_pos, reading data window by window."""
+    size = bdata_length(fdata)
+    pos = start_pos
+    while pos < size:
+        bdata, a0, o0, n = fdata(pos, window + len(sub))
+        i = bdata.find(sub, a0, a0 + n)
+        if i != -1:
+            return o0 + i
+        pos += window
+    return -1
+
+
 def hexdump(bdata: Callable, start: int = None, stop: int = None) -> str:
     """Build a string similar to hexdump -C for binary data exploration"""
     LN = 10
@@ -95,12 +178,12 @@ def hexdump(bdata: Callable, start: int = None, stop: int = None) -> str:
     length = stop - start
     idx = (start // LN) * LN
     buf, d0, i0, sz0 = bdata(idx, length+(start-idx))
-    i = d0 + i0
-    while i < d0 + i0 + sz0:
-        l = buf[i:i+LN]
+    i = d0
+    while i < d0 + sz0:
+        l = buf[i:min(i+LN, d0+sz0)]
         hexl = bytes.hex(l, ' ')
         hext = bytes([ascii_hexdump_printable(c) for c in l]).decode('ascii')
-        ret += f"{i:0{LN}d}  {hexl:{LN*3-1}}  |{hext}|\n"
+        ret += f"{i0+i:0{LN}d}  {hexl:{LN*3-1}}  |{hext}|\n"
         i += LN
     return ret
 
@@ -131,7 +214,7 @@ def file_object_map(fdata: Callable) -> list:
                 ln += 1
         elif t == 'IND_OBJ' and type(content['obj']) == Stream:
             if content['obj']['entries'].get('/Type') == '/XRef':
-                xrefstream = parse_xref_stream_raw(content['obj'], bo)
+                xrefstream = parse_xref_stream_raw(content['obj'], bo, pretty=True)
                 _, _, typ, obj = xrefstream
                 table = obj['table']
                 current_sub = -1
@@ -166,20 +249,11 @@ def parse_xref_table(bdata: bytes, start_pos: int, general_offset: int) -> list:
     - o_num is the object number
     - o_gen is the object generation number
     """
-    xref = []
-    table = []
     _, _, _, xref_table = parse_xref_table_raw(bdata, start_pos)
     lines = xref_table['table']
     trailer_pos = bdata.find(b'trailer', start_pos)
-    for line in lines:
-        if len(line) == 2:
-            table.append((f"{line[0]} {line[1]}".encode('ascii'), None))
-        elif len(line) == 4:
-            offset, o_num, o_gen, keyword = line
-            if keyword != b'f' and o_num != 0:
-                xref.append({'abs_pos': offset, 'o_num': o_num, 'o_gen': o_gen})
-            table.append((f"{offset:010d} {o_gen:05d} {keyword.decode('ascii')} ".encode('ascii'), o_num))
-            o_num += 1
+    xref = [{'abs_pos': line[0], 'o_num': line[1], 'o_gen': line[2]}
+            for line in lines if len(line) == 4 and line[3] != b'f' and line[1] != 0]
     trailer = {
         'o_num': 0,
         'o_gen': 0,
@@ -267,30 +341,28 @@ def build_xref_sequence(fdata: Callable) -> tuple:
             last = startxref_pos
         elif xrefstm:
             xref_pos = xrefstm
-            startxref_pos = o0 + bdata.find(STARTXREF, xref_pos)
-            eof_pos = o0 + bdata.find(EOF, xref_pos)
+            startxref_pos = bdata_find(fdata, STARTXREF, xref_pos)
+            eof_pos = bdata_find(fdata, EOF, xref_pos)
             last = eof_pos
             xrefstm = False
         elif prev:
             xref_pos = prev
-            startxref_pos = o0 + bdata.find(STARTXREF, xref_pos)
-            eof_pos = o0 + bdata.find(EOF, xref_pos)
+            startxref_pos = bdata_find(fdata, STARTXREF, xref_pos)
+            eof_pos = bdata_find(fdata, EOF, xref_pos)
             last = eof_pos
             prev = False
         bdata, a0, o0, _ = fdata(xref_pos, last - xref_pos)
         if bdata[a0:a0+4] == XREF:
             xref_index = parse_xref_table(bdata, a0, o0)
             i, j, _ = next_token(bdata, xref_index[0]['abs_pos'] - o0) #b'trailer'
-            i, j, _ = next_token(bdata, j)                            #dict
-            trailer = parse_obj(bdata[i:j])
+            trailer = parse_obj(bdata, j)                             #dict
         else: # must be a /XRef stream
             bdata, a0, o0, _ = fdata(xref_pos, startxref_pos - xref_pos)
-            i, j, _ = next_token(bdata, a0 - o0) #o_num
+            i, j, _ = next_token(bdata, a0) #o_num
             o_num = parse_obj(bdata, i)
             i, j, _ = next_token(bdata, j)       #o_ver
             i, j, _ = next_token(bdata, j)       #b'obj'
-            i, j, _ = next_token(bdata, j)       #dict
-            xref = parse_obj(bdata, i)
+            xref = parse_obj(bdata, j)           #dict
             xref_index = parse_xref_stream(xref, xref_pos, o_num)
             trailer = xref['entries']
         xref_index[0]['startxref_pos'] = startxref_pos
@@ -313,11 +385,372 @@ def build_xref_sequence(fdata: Callable) -> tuple:
     return chrono, nxt, nb
 
 
+def embedded_pos(loc: int, o_pos: int) -> float:
+    """Sort key of an object embedded at rank o_pos of the object stream found at loc."""
+    return loc + (o_pos + 1) / 10000
+
+
+class IndexEntry(dict):
+    """Read-only entry dict of a revision index, its copies being plain dicts."""
+
+    __slots__ = ()
+
+    def read_only(self, *args, **kwargs):
+        raise TypeError("index entries are read-only, store dict(entry) back into the index instead")
+
+    __setitem__ = __delitem__ = __ior__ = clear = pop = popitem = setdefault = update = read_only
+
+    def __copy__(self):
+        return dict(self)
+
+    def __deepcopy__(self, memo):
+        return deepcopy(dict(self), memo)
+
+    def __reduce__(self):
+        return (dict, (dict(self),))
+
+
+class IndexChunk:
+    """Slice of INDEX_CHUNK entries of a revision index, stored as parallel arrays."""
+
+    __slots__ = ('owner', 'flags', 'columns', 'extras')
+
+    def __init__(self, owner):
+        """Constructor."""
+        self.owner = owner
+        self.flags = array('H')
+        self.columns = [array(typecode) for _, typecode in INDEX_COLUMNS]
+        self.extras = {}
+
+    def clone(self, owner):
+        """Copy the chunk for a new owner."""
+        new_chunk = IndexChunk(owner)
+        new_chunk.flags = array('H', self.flags)
+        new_chunk.columns = [array(col.typecode, col) for col in self.columns]
+        new_chunk.extras = {k: (v.copy() if type(v) == dict else v) for k, v in self.extras.items()}
+        return new_chunk
+
+    def decode(self, k: int):
+        """Build a read-only view of the entry dict of slot k."""
+        f = self.flags[k]
+        if not f & F_PRESENT:
+            return None
+        if f & F_RAW:
+            return self.extras[k]
+        entry = {}
+        for c, (key, _) in enumerate(INDEX_COLUMNS):
+            if f & (F_COLUMN << c):
+                entry[key] = self.columns[c][k]
+        if f & F_EMBEDDED_POS:
+            entry['abs_pos'] = embedded_pos(entry['abs_pos'], entry['o_pos'])
+        if f & F_DELETED:
+            entry['DELETED'] = True
+        if k in self.extras:
+            entry.update(self.extras[k])
+        return IndexEntry(entry)
+
+    def encode(self, k: int, entry):
+        """Store an entry dict (or None) in slot k."""
+        if self.extras:
+            self.extras.pop(k, None)
+        if entry is None:
+            self.flags[k] = 0
+            return
+        if type(entry) == IndexEntry:
+            entry = dict(entry)
+        if type(entry) != dict:
+            self.flags[k] = F_PRESENT | F_RAW
+            self.extras[k] = entry
+            return
+        plan = index_plan(entry)
+        if plan is not None:
+            f, cols = plan
+            columns = self.columns
+            try:
+                for c, v in zip(cols, entry.values()):
+                    if type(v) is not int:
+                        break
+                    columns[c][k] = v
+                else:
+                    self.flags[k] = f
+                    return
+            except OverflowError:
+                pass
+        f = F_PRESENT
+        extras = {}
+        for key, v in entry.items():
+            c = INDEX_COLUMN_NUM.get(key)
+            if c is not None and type(v) == int:
+                try:
+                    self.columns[c][k] = v
+                except OverflowError:
+                    extras[key] = v
+                    continue
+                f |= F_COLUMN << c
+            elif key == 'DELETED' and v is True:
+                f |= F_DELETED
+            else:
+                extras[key] = v
+        v = extras.get('abs_pos')
+        if type(v) == float and f & (F_COLUMN << 7):
+            o_pos = self.columns[7][k]
+            loc = round(v - (o_pos + 1) / 10000)
+            if embedded_pos(loc, o_pos) == v:
+                try:
+                    self.columns[4][k] = loc
+                except OverflowError:
+                    pass
+                else:
+                    del extras['abs_pos']
+                    f |= F_EMBEDDED_POS | (F_COLUMN << 4)
+        self.flags[k] = f
+        if extras:
+            self.extras[k] = extras
+
+    def field(self, k: int, key: str, default=None):
+        """Read a single field of slot k without building the entry dict."""
+        f = self.flags[k]
+        if not f & F_PRESENT:
+            return default
+        if f & F_RAW:
+            return self.extras[k].get(key, default)
+        c = INDEX_COLUMN_NUM.get(key)
+        if c is not None and f & (F_COLUMN << c):
+            if c == 4 and f & F_EMBEDDED_POS:
+                return embedded_pos(self.columns[4][k], self.columns[7][k])
+            return self.columns[c][k]
+        if key == 'DELETED' and f & F_DELETED:
+            return True
+        return self.extras.get(k, {}).get(key, default)
+
+    def extend(self, entries: list):
+        """Add slots at the end."""
+        start = len(self.flags)
+        nb = len(entries)
+        self.flags.frombytes(bytes(nb * self.flags.itemsize))
+        for col in self.columns:
+            col.frombytes(bytes(nb * col.itemsize))
+        for k, entry in enumerate(entries, start):
+            self.encode(k, entry)
+
+    def column(self, key: str, default=None) -> list:
+        """Read a field of all the slots."""
+        c = INDEX_COLUMN_NUM.get(key)
+        if c is not None:
+            bit = F_COLUMN << c
+            col = self.columns[c]
+            res = [v if f & bit else default for f, v in zip(self.flags, col)]
+            if c == 4:
+                for k, f in enumerate(self.flags):
+                    if f & F_EMBEDDED_POS:
+                        res[k] = embedded_pos(col[k], self.columns[7][k])
+        elif key == 'DELETED':
+            res = [True if f & F_DELETED else default for f in self.flags]
+        else:
+            res = [default] * len(self.flags)
+        for k in self.extras:
+            res[k] = self.field(k, key, default)
+        return res
+
+    def pop(self):
+        """Remove the last slot."""
+        k = len(self.flags) - 1
+        self.flags.pop()
+        for col in self.columns:
+            col.pop()
+        self.extras.pop(k, None)
+
+
+INDEX_COLUMN_NUM = {key: c for c, (key, _) in enumerate(INDEX_COLUMNS)}
+INDEX_PLANS = {}
+
+
+def index_plan(entry: dict) -> tuple:
+    """Return flags and column numbers of an entry whose keys are all columns, memoized by key sequence."""
+    keys = tuple(entry)
+    if keys not in INDEX_PLANS:
+        if all(key in INDEX_COLUMN_NUM for key in keys):
+            cols = tuple(INDEX_COLUMN_NUM[key] for key in keys)
+            f = F_PRESENT
+            for c in cols:
+                f |= F_COLUMN << c
+            INDEX_PLANS[keys] = (f, cols)
+        else:
+            INDEX_PLANS[keys] = None
+    return INDEX_PLANS[keys]
+
+
+class RevisionIndex:
+    """Index of a revision, a list of entries (dict or None) stored in columns.
+
+    Entry 0 (trailer) is kept as is, the others are split into chunks of
+    parallel arrays that are shared with copies until one of them is changed.
+    Indexing any other entry returns a read-only view of a new dict: a changed
+    entry is built with dict(index[i]) and stored back with index[i] = entry.
+    Removing an entry other than the last one rebuilds the whole index.
+    """
+
+    def __init__(self, entries=()):
+        """Constructor."""
+        self.head = None
+        self.chunks = []
+        self.size = 0
+        self.token = object()
+        self.extend(entries)
+
+    def __len__(self):
+        return self.size
+
+    def locate(self, i: int) -> tuple:
+        """Return chunk number and slot of entry i."""
+        if i < 0:
+            i += self.size
+        if i < 0 or i >= self.size:
+            raise IndexError('index entry out of range')
+        return divmod(i, INDEX_CHUNK)
+
+    def writable(self, c: int) -> IndexChunk:
+        """Return chunk c, copied first if it is shared."""
+        chunk = self.chunks[c]
+        if chunk.owner is not self.token:
+            chunk = chunk.clone(self.token)
+            self.chunks[c] = chunk
+        return chunk
+
+    def __getitem__(self, i):
+        if type(i) == slice:
+            return [self[j] for j in range(*i.indices(self.size))]
+        c, k = self.locate(i)
+        if c == 0 and k == 0:
+            return self.head
+        return self.chunks[c].decode(k)
+
+    def __setitem__(self, i, entry):
+        c, k = self.locate(i)
+        if c == 0 and k == 0:
+            self.head = entry
+        else:
+            self.writable(c).encode(k, entry)
+
+    def field(self, i: int, key: str, default=None):
+        """Read a single field of entry i, default if entry or field is absent."""
+        c, k = self.locate(i)
+        if c == 0 and k == 0:
+            return self.head.get(key, default) if type(self.head) == dict else default
+        return self.chunks[c].field(k, key, default)
+
+    def column(self, key: str, default=None) -> list:
+        """Read a field of all entries, default where entry or field is absent."""
+        if self.size == 0:
+            return []
+        res = [self.head.get(key, default) if type(self.head) == dict else default]
+        for c, chunk in enumerate(self.chunks):
+            col = chunk.column(key, default)
+            res += col[1:] if c == 0 else col
+        return res
+
+    def unshared(self, other) -> list:
+        """List the entry numbers (except 0) that are not physically shared with another revision."""
+        res = []
+        for c, chunk in enumerate(self.chunks):
+            first = max(1, c * INDEX_CHUNK)
+            last = min(self.size, (c + 1) * INDEX_CHUNK)
+            if type(other) == RevisionIndex and c < len(other.chunks) and chunk is other.chunks[c]:
+                continue
+            res.extend(range(first, last))
+        return res
+
+    def shares(self, other, i: int) -> bool:
+        """Tell if entry i is physically shared with another revision (so it is equal)."""
+        if type(other) != RevisionIndex or i <= 0 or i >= self.size or i >= other.size:
+            return False
+        c = i // INDEX_CHUNK
+        return self.chunks[c] is other.chunks[c]
+
+    def append(self, entry):
+        self.extend([entry])
+
+    def extend(self, entries):
+        entries = list(entries)
+        if entries and self.size == 0:
+            self.head = entries[0]
+            self.chunks.append(IndexChunk(self.token))
+            self.chunks[0].extend([None])
+            self.size = 1
+            entries = entries[1:]
+        i = 0
+        while i < len(entries):
+            c = self.size // INDEX_CHUNK
+            if c == len(self.chunks):
+                self.chunks.append(IndexChunk(self.token))
+            block = entries[i:i + (c + 1) * INDEX_CHUNK - self.size]
+            self.writable(c).extend(block)
+            self.size += len(block)
+            i += len(block)
+
+    def pop(self, i: int = -1):
+        if i not in (-1, self.size - 1):
+            entries = list(self)
+            res = entries.pop(i)
+            self.__init__(entries)
+            return res
+        res = self[-1]
+        self.size -= 1
+        if self.size == 0:
+            self.head = None
+            self.chunks = []
+            return res
+        c = self.size // INDEX_CHUNK
+        self.writable(c).pop()
+        if len(self.chunks[c].flags) == 0:
+            self.chunks.pop()
+        return res
+
+    def __delitem__(self, i):
+        self.pop(i)
+
+    def __iter__(self):
+        if self.size == 0:
+            return
+        yield self.head
+        for c, chunk in enumerate(self.chunks):
+            for k in range(1 if c == 0 else 0, len(chunk.flags)):
+                yield chunk.decode(k)
+
+    def copy(self):
+        """Shallow copy sharing all chunks until they are changed."""
+        new_rev = RevisionIndex()
+        new_rev.head = self.head
+        new_rev.chunks = self.chunks[:]
+        new_rev.size = self.size
+        self.token = object()
+        return new_rev
+
+    def __deepcopy__(self, memo):
+        new_rev = self.copy()
+        new_rev.head = deepcopy(self.head, memo)
+        return new_rev
+
+    def __eq__(self, other):
+        if type(other) != RevisionIndex and type(other) != list:
+            return NotImplemented
+        return len(self) == len(other) and all(x == y for x, y in zip(self, other))
+
+    def __add__(self, other):
+        return RevisionIndex(list(self) + list(other))
+
+    def __repr__(self):
+        return repr(list(self))
+
+
 def build_index_from_xref_sequence(xref_seq: list, nxt: dict, nb: int) -> list:
-    """Build a multi-dimensional array where each column represents a doc update."""
+    """Build a multi-dimensional array where each column represents a doc update.
+
+    Each revision is filled directly into a RevisionIndex sharing the chunks
+    of the previous one, the entries changed by a revision being encoded
+    when it is closed.
+    """
     nb = nb + 2
-    m = nb * [None]
-    abs_pos_array = nb * [0]
     index = []
     doc_ver = -1
     prev_pos = 0
@@ -333,60 +766,285 @@ def build_index_from_xref_sequence(xref_seq: list, nxt: dict, nb: int) -> list:
             new_xref_seq[-1] = p
         else:
             new_xref_seq.append(x)
+    rev = RevisionIndex([None] * nb)
+    changed = {}
     for x in new_xref_seq:
         trailer = x[0]
         if trailer['abs_pos'] > prev_pos: # or trailer.get('xref_stm'):
-            m = m[:]
-            index.append(m)
+            if index:
+                close_revision(rev, changed, nxt, doc_ver)
+                rev = rev.copy()
+                changed = {}
+            index.append(rev)
             doc_ver += 1
-            m[0] = trailer
+            rev[0] = trailer
             prev_pos = trailer['abs_pos']
         else:
-            m[0] = [m[0], trailer]
+            rev[0] = [rev[0], trailer]
         trailer['o_ver'] = doc_ver
         trailer['doc_ver'] = doc_ver
         for obj in x[1:]:
-            if m[obj['o_num']] is None:
-                obj['o_ver'] = 0
-                obj['doc_ver'] = doc_ver
+            num = obj['o_num']
+            if num in changed:
+                old_obj, o_ver = changed[num]
             else:
-                old_obj = index[-1][obj['o_num']]
-                if 'abs_pos' in old_obj and 'abs_pos' in obj and old_obj['abs_pos'] == obj['abs_pos']:
-                    #Special case for hybrid docs where an obj appears both in xref table and stream
-                    obj = old_obj
-                else:
-                    obj['o_ver'] = old_obj['o_ver'] + 1
-                    obj['doc_ver'] = doc_ver
-            m[obj['o_num']] = obj
-    for current in index:
-        for x in current:
-            if x is None:
+                old_obj = rev[num]
+                o_ver = old_obj and old_obj['o_ver']
+            if old_obj is None:
+                o_ver = 0
+            elif 'abs_pos' in old_obj and 'abs_pos' in obj and xref_pos(old_obj) == obj['abs_pos']:
+                #Special case for hybrid docs where an obj appears both in xref table and stream
                 continue
-            elif type(x) == dict:
-                x = [x]
-            for y in x:
-                if y.get('abs_next'):
-                    continue
-                abs_pos = y.get('abs_pos')
-                env_num = y.get('env_num')
-                if type(abs_pos) == tuple:
-                    e, offset = abs_pos
-                    loc = current[e]['abs_pos']
-                    y['abs_pos'] = loc + (offset + 1) / 10000
-                    abs_pos = loc
-                y['abs_next'] = nxt[abs_pos]
+            else:
+                o_ver += 1
+            changed[num] = (obj, o_ver)
+    if index:
+        close_revision(rev, changed, nxt, doc_ver)
     return index
 
 
+def xref_pos(entry) -> Any:
+    """Return abs_pos of an entry as found in xref, (env_num, o_pos) for an embedded object."""
+    abs_pos = entry['abs_pos']
+    if type(abs_pos) == float and 'env_num' in entry:
+        return (entry['env_num'], entry['o_pos'])
+    return abs_pos
+
+
+def close_revision(rev: RevisionIndex, changed: dict, nxt: dict, doc_ver: int) -> None:
+    """Complete the trailers of a revision and store the entries it changes.
+
+    changed maps object numbers to their xref entry and version, the xref
+    entries being left untouched.
+    """
+    trailers = rev[0] if type(rev[0]) == list else [rev[0]]
+    for trailer in trailers:
+        if not trailer.get('abs_next'):
+            trailer['abs_next'] = nxt[trailer.get('abs_pos')]
+    for num, (obj, o_ver) in changed.items():
+        entry = {**obj, 'o_ver': o_ver, 'doc_ver': doc_ver}
+        abs_pos = obj.get('abs_pos')
+        if type(abs_pos) == tuple:
+            e, offset = abs_pos
+            loc = changed[e][0]['abs_pos'] if e in changed else rev.field(e, 'abs_pos')
+            entry['abs_pos'] = embedded_pos(loc, offset)
+            abs_pos = loc
+        entry['abs_next'] = nxt[abs_pos]
+        rev[num] = entry
+
+
+def file_fingerprint(file_obj: IO, fdata: Callable) -> str:
+    """Identify a file by its size, mtime and a hash of its tail bytes.
+
+    Return None if the data source is not a regular file.
+    """
+    try:
+        st = os.fstat(file_obj.fileno())
+    except (AttributeError, OSError, ValueError):
+        return None
+    size = bdata_length(fdata)
+    if size != st.st_size:
+        return None
+    return f"{INDEX_CACHE_FORMAT}-{size}-{st.st_mtime_ns}-{tail_hash(fdata)}"
+
+
+def tail_hash(fdata: Callable, length: int = INDEX_CACHE_TAIL) -> str:
+    """Hash the last bytes of a data source."""
+    size = bdata_length(fdata)
+    n = min(size, length)
+    bdata, a0, _, nb_read = fdata(size - n, n) if n else (b'', 0, 0, 0)
+    return hashlib.sha256(bdata[a0:a0+nb_read]).hexdigest()
+
+
+def index_cache_path(directory: str, fingerprint: str) -> str:
+    """Path of the sidecar file holding the index of a fingerprinted file."""
+    key = hashlib.sha256(fingerprint.encode('ascii')).hexdigest()
+    return os.path.join(directory, key + INDEX_CACHE_SUFFIX)
+
+
+def index_cache_layout() -> list:
+    """Typecode and item size of the arrays stored in a sidecar file, on this platform."""
+    typecodes = ['H'] + [typecode for _, typecode in INDEX_COLUMNS]
+    return [[typecode, array(typecode).itemsize] for typecode in typecodes]
+
+
+def trailer_to_json(obj):
+    """Convert a parsed trailer into JSON values, tagging references and strings.
+
+    PDF dictionary keys are names starting with a slash, so the one-key tag
+    dictionaries cannot be mistaken for a trailer dictionary.
+    """
+    t = type(obj)
+    if t == dict:
+        return {k: trailer_to_json(v) for k, v in obj.items()}
+    elif t == list:
+        return [trailer_to_json(v) for v in obj]
+    elif t == complex:
+        return {'ref': [int(obj.real), int(obj.imag)]}
+    elif t == bytes:
+        return {'bytes': obj.decode('latin-1')}
+    elif t in (str, int, float, bool):
+        return obj
+    else:
+        raise ValueError('trailer not serializable')
+
+
+def trailer_from_json(obj):
+    """Rebuild a parsed trailer from the JSON values of trailer_to_json."""
+    if type(obj) == dict:
+        if 'ref' in obj:
+            gen, num = obj['ref']
+            return complex(gen, num)
+        elif 'bytes' in obj:
+            return obj['bytes'].encode('latin-1')
+        return {k: trailer_from_json(v) for k, v in obj.items()}
+    elif type(obj) == list:
+        return [trailer_from_json(v) for v in obj]
+    return obj
+
+
+def encode_index_cache(fingerprint: str, index: list, trailer: dict) -> bytes:
+    """Serialize an index and the current trailer as a JSON header line followed by the raw bytes of the index arrays.
+
+    Raise ValueError if the index or the trailer holds values that JSON cannot represent faithfully.
+    """
+    revisions = []
+    arrays = []
+    for rev in index:
+        if type(rev) != RevisionIndex:
+            raise ValueError('index not serializable')
+        chunks = []
+        for chunk in rev.chunks:
+            extras = {str(k): v for k, v in chunk.extras.items()}
+            chunks.append({'slots': len(chunk.flags), 'extras': extras})
+            arrays.append(chunk.flags.tobytes())
+            arrays.extend(col.tobytes() for col in chunk.columns)
+        revisions.append({'head': rev.head, 'size': rev.size, 'chunks': chunks})
+    header = {
+        'format': INDEX_CACHE_FORMAT,
+        'fingerprint': fingerprint,
+        'byteorder': sys.byteorder,
+        'layout': index_cache_layout(),
+        'revisions': revisions,
+        'trailer': trailer_to_json(trailer),
+    }
+    try:
+        text = json.dumps(header, separators=(',', ':'))
+    except TypeError as e:
+        raise ValueError('index not serializable') from e
+    if json.loads(text) != header:
+        raise ValueError('index not serializable')
+    return text.encode('ascii') + b'\n' + b''.join(arrays)
+
+
+def decode_index_cache(data: bytes, fingerprint: str) -> tuple:
+    """Rebuild an index and the current trailer from the bytes of a sidecar file.
+
+    Raise ValueError if the data is malformed or written for another file or platform.
+    """
+    nl = data.index(b'\n')
+    header = json.loads(data[:nl])
+    if type(header) != dict or header.get('format') != INDEX_CACHE_FORMAT:
+        raise ValueError('unknown index cache format')
+    if header.get('fingerprint') != fingerprint:
+        raise ValueError('index cache of another file')
+    if header.get('byteorder') != sys.byteorder or header.get('layout') != index_cache_layout():
+        raise ValueError('index cache of another platform')
+    pos = nl + 1
+    index = []
+    try:
+        for r in header['revisions']:
+            rev = RevisionIndex()
+            rev.head = r['head']
+            rev.size = r['size']
+            for c in r['chunks']:
+                chunk = IndexChunk(rev.token)
+                nb = c['slots']
+                for a in [chunk.flags] + chunk.columns:
+                    length = nb * a.itemsize
+                    if pos + length > len(data):
+                        raise ValueError('truncated index cache')
+                    a.frombytes(data[pos:pos+length])
+                    pos += length
+                chunk.extras = {int(k): v for k, v in c['extras'].items()}
+                rev.chunks.append(chunk)
+            if sum(len(chunk.flags) for chunk in rev.chunks) != rev.size:
+                raise ValueError('inconsistent index cache')
+            index.append(rev)
+        trailer = trailer_from_json(header['trailer'])
+    except (KeyError, TypeError, AttributeError) as e:
+        raise ValueError('malformed index cache') from e
+    if pos != len(data) or type(trailer) != dict:
+        raise ValueError('inconsistent index cache')
+    return index, trailer
+
+
+def read_index_cache(directory: str, fingerprint: str) -> tuple:
+    """Return the cached index and trailer of a file, or None if missing, stale or unreadable."""
+    path = index_cache_path(directory, fingerprint)
+    try:
+        with open(path, 'rb') as f:
+            cached = decode_index_cache(f.read(), fingerprint)
+    except (OSError, ValueError):
+        return None
+    try:
+        os.utime(path) #Recently used entries are evicted last
+    except OSError:
+        pass
+    return cached
+
+
+def write_index_cache(directory: str, fingerprint: str, index: list, trailer: dict, max_bytes: int = INDEX_CACHE_MAX_BYTES) -> None:
+    """Store the index and trailer of a file and trim the directory to max_bytes, oldest first."""
+    try:
+        data = encode_index_cache(fingerprint, index, trailer)
+    except ValueError:
+        return
+    path = index_cache_path(directory, fingerprint)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(directory, exist_ok=True)
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except OSError:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return
+    trim_index_cache(directory, max_bytes)
+
+
+def trim_index_cache(directory: str, max_bytes: int) -> None:
+    """Remove the least recently used sidecar files until the directory fits in max_bytes."""
+    entries = []
+    for name in os.listdir(directory):
+        if not name.endswith(INDEX_CACHE_SUFFIX):
+            continue
+        try:
+            st = os.stat(os.path.join(directory, name))
+        except OSError:
+            continue
+        entries.append((st.st_mtime_ns, st.st_size, name))
+    total = sum(e[1] for e in entries)
+    for _, size, name in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(os.path.join(directory, name))
+        except OSError:
+            pass
+        total -= size
+
+
 def eof_cut(eof_index: int, fdata: Callable) -> int:
     """Calculate where to cut the byte stream of a revision: after %%EOF and possibly EOLs"""
-    bdata, start, _, n = fdata(eof_index, bdata_length(fdata) - eof_index)
+    bdata, start, o0, n = fdata(eof_index, bdata_length(fdata) - eof_index)
     i = start + len('%%EOF')
     while i < start + n:
         if bdata[i] not in EOL:
             break
         i += 1
-    return i
+    return o0 + i
 
 
 def circular_deleted(changes: list) -> dict:
@@ -428,15 +1086,14 @@ def format_xref_table(elems: list, trailer: dict, next_free: dict) -> bytes:
         num = xref_table[i][1]
     header = str(num).encode('ascii') + b' ' + str(nb).encode('ascii')
     xref_table.insert(0, (header, None))
-    build_xref_table = b'xref\n'
+    out = [b'xref\n']
     for x, _ in xref_table:
-        build_xref_table += x
-        build_xref_table += b'\n'
-    ser0 = serialize(trailer)
-    build_xref_table += b'trailer\n'
-    build_xref_table += ser0 
-    build_xref_table += b'\n'
-    return build_xref_table
+        out.append(x)
+        out.append(b'\n')
+    out.append(b'trailer\n')
+    serialize_into(trailer, out)
+    out.append(b'\n')
+    return b''.join(out)
 
 
 def format_xref_stream(elems: list, trailer: dict, next_free: dict, o_num: int) -> bytes:
@@ -473,9 +1130,7 @@ def format_xref_stream(elems: list, trailer: dict, next_free: dict, o_num: int)
         num = xref_stream[i][1]
     index = [num, nb] + index
     trailer['/Index'] = index
-    st = b''
-    for x, _ in xref_stream:
-        st += x
+    st = b''.join([x for x, _ in xref_stream])
     s, _ = forge_stream(trailer, st)
     ser0 = serialize(s)
     build_xref_stream = b''
@@ -489,11 +1144,10 @@ def format_xref_stream(elems: list, trailer: dict, next_free: dict, o_num: int)
 
 def serialize_fragment(num, o_gen, obj):
     """Build ascii block representing indirect object in file."""
-    beginobj = f'{num} {o_gen}'.encode('ascii') + b' obj\n'
-    ser = serialize(obj) + b'\n'
-    endobj = b'endobj\n'
-    block = beginobj + ser + endobj
-    return block
+    out = [f'{num} {o_gen} obj\n'.encode('ascii')]
+    serialize_into(obj, out)
+    out.append(b'\nendobj\n')
+    return b''.join(out)
 
 
 def append_to_stream_fragment(num, obj, envelope):
@@ -541,7 +1195,6 @@ def build_revision_byte_stream(
     """List the sequence of byte blocks that make the update."""
     fragments = []
     xref_table = []
-    res = b''
     new_index = deepcopy(current_index)
     counter = starting_pos + len(MARGIN)
     fragments.append(MARGIN)
@@ -549,8 +1202,8 @@ def build_revision_byte_stream(
     l = [(0j, 'd')] + changes
     for c, action in l:
         num = int(c.imag)
-        o_gen = current_index[num]['o_gen']
-        env_num = current_index[num].get('env_num')
+        o_gen = current_index.field(num, 'o_gen')
+        env_num = current_index.field(num, 'env_num')
         if action != 'd' and env_num:
             new_env = append_to_stream_fragment(num, cache[num], cache[env_num])
             cache[env_num] = new_env
@@ -561,11 +1214,11 @@ def build_revision_byte_stream(
             if num == 0:
                 o_gen = 65535 - 1
             else:
-                o_gen = current_index[num]['o_gen']
+                o_gen = current_index.field(num, 'o_gen')
             xref_table.append(('f', num, o_gen, None, None))
         else:
-            o_gen = current_index[num]['o_gen']
-            env_num = current_index[num].get('env_num')
+            o_gen = current_index.field(num, 'o_gen')
+            env_num = current_index.field(num, 'env_num')
             if not env_num:
                 obj = cache[num]
                 if type(obj) == Stream and obj['entries'].get('/Type') == '/ObjStm':
@@ -573,8 +1226,10 @@ def build_revision_byte_stream(
                 block = serialize_fragment(num, o_gen, obj)
                 fragments.append(block)
                 xref_table.append(('n', num, o_gen, counter, env_num))
-                new_index[num]['abs_pos'] = counter
-                new_index[num]['abs_next'] = counter + len(block)
+                entry = dict(new_index[num])
+                entry['abs_pos'] = counter
+                entry['abs_next'] = counter + len(block)
+                new_index[num] = entry
                 counter += len(block)
     xref_table.sort(key=lambda xr: xr[1])
     if not xref_stream_num:
@@ -586,17 +1241,17 @@ def build_revision_byte_stream(
     else:
         xref_table.append(('n', xref_stream_num, 0, counter, None))
         built_xref = format_xref_stream(xref_table, cache[0], next_free, xref_stream_num)
-        new_index[xref_stream_num]['abs_pos'] = counter
-        new_index[xref_stream_num]['abs_next'] = counter + len(block)
+        entry = dict(new_index[xref_stream_num])
+        entry['abs_pos'] = counter
+        entry['abs_next'] = counter + len(block)
+        new_index[xref_stream_num] = entry
         new_index[0]['xref_stream_pos'] = counter
         new_index[0]['abs_pos'] = counter
         new_index[0]['abs_next'] = counter + len(built_xref)
     fragments.append(built_xref)
     fragments.append(f'startxref\n{counter}\n'.encode('ascii'))
     fragments.append(b'%%EOF\n')
-    for i in fragments:
-        res += i
-    return res, new_index
+    return b''.join(fragments), new_index
 
 
 def linearized(fdata: Callable) -> dict:
@@ -607,12 +1262,9 @@ def linearized(fdata: Callable) -> dict:
     i, j, _ = next_token(bdata, j)  #o_num
     i, j, _ = next_token(bdata, j)  #gen_num
     i, j, _ = next_token(bdata, j)  #obj keyword
-    i, j, t = next_token(bdata, j)  #dict ?
-    if t == 'DICT':
-        o = bdata[i:j]
-        first_obj = parse_obj(o)
-        if type(first_obj) == dict and '/Linearized' in first_obj:
-            return first_obj
+    i, j, first_obj = next_obj(bdata, j)  #dict ?
+    if type(first_obj) == dict and '/Linearized' in first_obj:
+        return first_obj
     return None
 
 
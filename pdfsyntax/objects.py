@@ -1,8 +1,10 @@
 """Module pdfsyntax.objects: Parser"""
 
+import re
+import sys
+from array import array
 from typing import Any
 from collections import namedtuple
-from dataclasses import dataclass
 from .filters import *
 #from .filestruct import expand_xref_index
 
@@ -10,16 +12,68 @@ EOL = b'\r\n'
 SPACE = EOL + b'\x00\x09\x0c\x20'
 DELIMITERS = b'<>[]/(){}%'
 
+TOKENIZER = "TABLE"
+
+#Character classes of the table-driven tokenizer
+C_OTHER, C_RBRACKET, C_GT, C_LT, C_LBRACKET, C_SLASH, C_VALUE, C_ALPHA, C_LPAREN, C_PERCENT = range(10)
+
+
+def char_classes() -> bytes:
+    """Build the 256-entry table giving the character class of every byte."""
+    table = bytearray(256)
+    for chars, c in ((b']', C_RBRACKET), (b'>', C_GT), (b'<', C_LT), (b'[', C_LBRACKET),
+                     (b'/', C_SLASH), (b'+-.0123456789', C_VALUE), (b'(', C_LPAREN), (b'%', C_PERCENT),
+                     (b'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ', C_ALPHA)):
+        for x in chars:
+            table[x] = c
+    return bytes(table)
+
+
+CHAR_CLASSES = char_classes()
+
+SKIPPED = re.compile(rb'(?:[^\]<>\[/+\-.0-9a-zA-Z(%]|>(?!>))*')
+REGULAR = re.compile(rb'[^\x00\t\n\x0c\r <>\[\]/(){}%]*')
+NOT_EOL = re.compile(rb'[^\r\n]*')
+IN_LSTRING = re.compile(rb'[()\\]')
+HSTRING_END = re.compile(rb'(?<!\\)>')
+DICT_DELIMITERS = re.compile(rb'<<|>>')
+ARRAY_DELIMITERS = re.compile(rb'[\[\]()]')
+XREF_SUBSECTION = re.compile(rb'(\d+) +(\d+) *(?=[\r\n])')
+XREF_ENTRIES = re.compile(rb'(?:\d{10} \d{5} [fn](?: \r| \n|\r\n))*')
+
 
-@dataclass
 class Stream:
-    entries: dict
-    stream: bytes
-    encoded: bytes
+    """PDF stream holding the encoded bytes, decoded on first access to stream."""
+
+    def __init__(self, entries: dict, stream: bytes, encoded: bytes):
+        self.entries = entries
+        self.encoded = encoded
+        self._stream = stream
+        self.offsets = None
+
+    @property
+    def stream(self) -> bytes:
+        if self._stream is None:
+            self._stream = decode_stream(self.encoded, self.entries)
+        return self._stream
+
+    @stream.setter
+    def stream(self, value: bytes):
+        self._stream = value
+        self.offsets = None
 
     def __getitem__(self, item):
         return getattr(self, item)
 
+    def __eq__(self, other):
+        if type(other) != Stream:
+            return NotImplemented
+        if self.entries != other.entries or self.encoded != other.encoded:
+            return False
+        if self._stream is None and other._stream is None:
+            return True
+        return self.stream == other.stream
+
     def __repr__(self):
         res = "<PDF Stream," + f" entries: {self.entries},"
         if len(self.stream) > 40:
@@ -64,7 +118,131 @@ def next_line(bdata: bytes, start_pos: int=0) -> tuple:
 
 
 def next_token(text: bytes, i=0) -> tuple:
-    """Find next token in raw string starting at some index."""
+    """Find next token in raw string starting at some index.
+
+    Return a tuple (start, end, type), the implementation being selected by TOKENIZER.
+    """
+    if TOKENIZER == "TABLE":
+        return next_token_table(text, i)
+    return next_token_bytewise(text, i)
+
+
+def lstring_end(text: bytes, i: int) -> int:
+    """Return the index following the literal string opened at i, or None if unterminated.
+
+    As in next_token_bytewise, a backslash only escapes a following parenthesis.
+    """
+    nested = 1
+    i += 1
+    while True:
+        mo = IN_LSTRING.search(text, i)
+        if mo is None:
+            return None
+        i = mo.start()
+        c = text[i]
+        if c == 0x5c: #backslash
+            i += 2 if text[i+1:i+2] in (b'(', b')') else 1
+            continue
+        elif c == 0x28:
+            nested += 1
+        else:
+            nested -= 1
+            if nested == 0:
+                return i + 1
+        i += 1
+
+
+def container_end(text: bytes, i: int, dictionary: bool) -> int:
+    """Return the index following the dict or array opened at i, or None if unterminated.
+
+    The delimiters are matched as in next_token_bytewise: only << and >> count
+    in a dict (from the second < of the opening one), and only parentheses,
+    toggling a flag, hide brackets in an array.
+    """
+    nested = 1
+    if dictionary:
+        for mo in DICT_DELIMITERS.finditer(text, i + 1):
+            nested += 1 if text[mo.start()] == 0x3c else -1
+            if nested == 0:
+                return mo.end()
+        return None
+    in_string = False
+    for mo in ARRAY_DELIMITERS.finditer(text, i + 1):
+        c = text[mo.start()]
+        if c == 0x28: #(
+            in_string = True
+        elif c == 0x29: #)
+            in_string = False
+        elif not in_string:
+            nested += 1 if c == 0x5b else -1
+            if nested == 0:
+                return mo.end()
+    return None
+
+
+def next_token_table(text: bytes, i=0) -> tuple:
+    """Find next token with precomputed character classes and compiled patterns."""
+    start = i
+    n = len(text)
+    if i >= n:
+        return (i, i, None)
+    h = SKIPPED.match(text, i).end()
+    if h >= n:
+        return (max(start, n - 1), n, None)
+    c = CHAR_CLASSES[text[h]]
+    if c == C_RBRACKET:
+        return (max(start, h - 1), h, None)
+    elif c == C_GT: #SKIPPED guarantees >>
+        return (max(start, h - 1), h + 1, None)
+    elif c == C_LT:
+        if text[h+1:h+2] == b'<':
+            j = container_end(text, h, True)
+            if j is None:
+                return (h, n, None)
+            return (h, j, 'DICT')
+        mo = HSTRING_END.search(text, h + 1)
+        if mo is None:
+            return (h, n, None)
+        return (h, mo.end(), 'STRING')
+    elif c == C_LBRACKET:
+        j = container_end(text, h, False)
+        if j is None:
+            return (h, n, None)
+        return (h, j, 'ARRAY')
+    elif c == C_LPAREN:
+        j = lstring_end(text, h)
+        if j is None:
+            return (h, n, None)
+        return (h, j, 'STRING')
+    elif c == C_PERCENT:
+        j = NOT_EOL.match(text, h + 1).end()
+        if j >= n:
+            return (h, n, None)
+        return (h, j, 'COMMENT')
+    elif c == C_ALPHA and text[h:h+6] == b'stream':
+        j = text.find(b'endstream', h + 1)
+        if j == -1:
+            return (h, n, None)
+        return (h, j + 9, 'STREAM')
+    j = REGULAR.match(text, h + 1).end()
+    if j >= n:
+        return (h, n, None)
+    if c == C_SLASH:
+        return (h, j, 'NAME')
+    elif c == C_VALUE:
+        if text.find(b'.', h, j) == -1:
+            return (h, j, 'INTEGER')
+        return (h, j, 'REAL')
+    word = text[h:j]
+    if word == b'true':
+        return (h, j, 'TRUE')
+    elif word == b'false':
+        return (h, j, 'FALSE')
+    return (h, j, 'KEYWORD')
+
+
+def next_token_bytewise(text: bytes, i=0) -> tuple:
+    """Find next token by examining the raw string byte after byte."""
     search = "TBD"
     nested = 1
     text_in_array = 0
@@ -203,87 +381,154 @@ def dedicated_type(text: bytes, type: str) -> Any:
         return text
 
 
-def parse_obj(text: bytes, start=0) -> Any:
-    """Recursively parse bytes into PDF objects."""
-    h1, j1, t1 = next_token(text, start)
-    obj = text[h1:j1]
-    if t1 == 'DICT':
-        res = {}
-        res_array = []
-        h2, j2, t2 = next_token(text, j1)
-        following_obj = text[h2:j2]
-        if t2 == 'STREAM': 
-            stream_def =  parse_obj(obj)
-            stream_encoded =  parse_obj(following_obj)
-            stream_content = decode_stream(stream_encoded, stream_def)
-            res = Stream(stream_def, stream_content, stream_encoded)
-            return res
-
-        i = start + 2
-        while i < j1 - 1:
-            h, i, t = next_token(text, i)
-            if t and t != 'COMMENT':
-                if i < j1 and t:
-                    if t == 'DICT' or t == 'ARRAY':
-                        obj = parse_obj(text[h:i])
-                    else:
-                        obj = dedicated_type(text[h:i], t)
-                    res_array.append(obj)
-        toggle = True
-        res_array = replace_ref(res_array)
-        j = len(res_array) - 1
-        while j >= 0:
-            if toggle:
-                val = res_array[j]
-                toggle = False
-            else:
-                key = res_array[j]
-                res[key] = val
-                toggle = True
-            j -= 1
-        return res
-    elif t1 == 'ARRAY':
-        res = []
-        i = start + 1
-        while i < j1 - 1:
-            h, i, t = next_token(text, i)
-            if t and t != 'COMMENT':
-                if t == 'DICT' or t == 'ARRAY':
-                    obj = parse_obj(text[h:i])
-                else:
-                    obj = dedicated_type(text[h:i], t)
-                res.append(obj)
-        res = replace_ref(res)
-        return res
-    elif t1 == 'STREAM':
-        b1 = b'stream' + b'\r\n'
-        b2 = b'stream' + b'\n'
-        e1 = b'\r\n' + b'endstream'
-        e2 = b'\n' + b'endstream'
-        e3 = b'\r' + b'endstream'
-        e4 = b'endstream'
-        if obj[:len(b1)] == b1:
-            b = len(b1)
-        elif obj[:len(b2)] == b2:
-            b = len(b2)
-        else:
-            return None
-        if obj[-len(e1):] == e1:
-            e = len(e1)
-        elif obj[-len(e2):] == e2:
-            e = len(e2)
-        elif obj[-len(e3):] == e3:
-            e = len(e3)
-        elif obj[-len(e4):] == e4:
-            e = len(e4)
-        else:
-            return None
-        s = obj[b:-e]
-        return s
-    elif t1 == 'COMMENT':
-        return ''
+def stream_payload(text: bytes, h: int, j: int) -> bytes:
+    """Extract the raw content of the STREAM token found between indexes h and j.
+
+    Without a usable /Length, the EOL preceding endstream is assumed not to be data.
+    """
+    if text[h:h+8] == b'stream\r\n':
+        b = h + 8
+    elif text[h:h+7] == b'stream\n':
+        b = h + 7
+    else:
+        return None
+    if text[j-11:j] == b'\r\nendstream':
+        e = j - 11
+    elif text[j-10:j] == b'\nendstream' or text[j-10:j] == b'\rendstream':
+        e = j - 10
+    elif text[j-9:j] == b'endstream':
+        e = j - 9
     else:
-        return dedicated_type(text[h1:j1], t1)
+        return None
+    return text[b:e]
+
+
+def stream_end(text: bytes, h: int, length: Any, deref=None) -> tuple:
+    """Use /Length to locate the end of the STREAM token starting at index h.
+
+    An indirect /Length is resolved with the deref callable if provided.
+    Return a tuple (exactly /Length bytes of payload, index following endstream),
+    or (None, None) if endstream is not where /Length says.
+    """
+    if type(length) == complex and deref is not None:
+        length = deref(length)
+    if type(length) != int or length < 0:
+        return (None, None)
+    if text[h+6:h+8] == b'\r\n':
+        b = h + 8
+    elif text[h+6:h+7] == b'\n':
+        b = h + 7
+    else:
+        return (None, None)
+    e = b + length
+    for k in (e, e + 1, e + 2):
+        if text[k:k+9] == b'endstream':
+            return (text[b:e], k + 9)
+        if text[k:k+1] not in (b'\r', b'\n'):
+            return (None, None)
+    return (None, None)
+
+
+def parse_container(text: bytes, i: int, dictionary: bool) -> tuple:
+    """Parse the items of a dict or array whose opening delimiter ends at index i.
+
+    Return a tuple (list of items, index following the closing delimiter),
+    the index being None if the container is not terminated.
+    """
+    res = []
+    n = len(text)
+    while True:
+        h = SKIPPED.match(text, i).end()
+        if h >= n:
+            return (res, None)
+        c = CHAR_CLASSES[text[h]]
+        if c == C_RBRACKET:
+            if not dictionary:
+                return (res, h + 1)
+            i = h + 1
+            continue
+        elif c == C_GT: #SKIPPED guarantees >>
+            if dictionary:
+                return (res, h + 2)
+            i = h + 2
+            continue
+        elif c == C_LT and text[h+1:h+2] == b'<':
+            items, i = parse_container(text, h + 2, True)
+            if i is None:
+                return (res, None)
+            res.append(items_to_dict(items))
+            continue
+        elif c == C_LBRACKET:
+            items, i = parse_container(text, h + 1, False)
+            if i is None:
+                return (res, None)
+            res.append(replace_ref(items))
+            continue
+        h, i, t = next_token(text, h)
+        if t is None:
+            return (res, None)
+        elif t != 'COMMENT':
+            res.append(dedicated_type(text[h:i], t))
+
+
+def items_to_dict(items: list) -> dict:
+    """Pair up the items of a dict, starting from the last one."""
+    res = {}
+    toggle = True
+    items = replace_ref(items)
+    j = len(items) - 1
+    while j >= 0:
+        if toggle:
+            val = items[j]
+            toggle = False
+        else:
+            key = items[j]
+            res[key] = val
+            toggle = True
+        j -= 1
+    return res
+
+
+def next_obj(text: bytes, i=0, deref=None) -> tuple:
+    """Find and parse next object in raw string starting at some index, in a single pass.
+
+    The optional deref callable resolves an indirect /Length of a stream.
+    Return a tuple (start, end, object).
+    """
+    n = len(text)
+    h = SKIPPED.match(text, i).end() if i < n else i
+    if h < n and text[h:h+2] == b'<<':
+        items, j = parse_container(text, h + 2, True)
+        if j is None:
+            return (h, n, text[h:n])
+        res = items_to_dict(items)
+        h2 = SKIPPED.match(text, j).end()
+        if text[h2:h2+6] == b'stream' and '/Length' in res:
+            stream_encoded, j2 = stream_end(text, h2, res['/Length'], deref)
+            if j2 is not None:
+                return (h, j2, Stream(res, None, stream_encoded))
+        h2, j2, t2 = next_token(text, j)
+        if t2 == 'STREAM':
+            stream_encoded = stream_payload(text, h2, j2)
+            return (h, j2, Stream(res, None, stream_encoded))
+        return (h, j, res)
+    elif h < n and text[h] == 0x5b: #[
+        items, j = parse_container(text, h + 1, False)
+        if j is None:
+            return (h, n, text[h:n])
+        return (h, j, replace_ref(items))
+    h, j, t = next_token(text, i)
+    if t == 'STREAM':
+        return (h, j, stream_payload(text, h, j))
+    elif t == 'COMMENT':
+        return (h, j, '')
+    return (h, j, dedicated_type(text[h:j], t))
+
+
+def parse_obj(text: bytes, start=0, deref=None) -> Any:
+    """Recursively parse bytes into PDF objects."""
+    _, _, obj = next_obj(text, start, deref)
+    return obj
 
 
 def parse_indirect_obj(text: bytes, start=0) -> tuple:
@@ -295,14 +540,30 @@ def parse_indirect_obj(text: bytes, start=0) -> tuple:
     o_num = int(text[i1:j1])
     o_gen = int(text[i2:j2])
     i, j, _ = next_token(text, j2) #obj
-    i, j, _ = next_token(text, j) #object1
-    o = parse_obj(text, i)
-    i, j, t = next_token(text, j)
-    if t == 'STREAM':
-        _, j, _ = next_token(text, j) #endobj
+    i, j, o = next_obj(text, j) #object1
+    _, j, _ = next_token(text, j) #endobj
     return (bo, j, 'IND_OBJ', {'o_num':o_num, 'o_gen':o_gen, 'obj':o})
 
 
+def object_stream_offsets(obj_stream: Stream) -> dict:
+    """Map the numbers of objects embedded in an object stream to their offsets in the decoded stream.
+
+    The table is built from the /First header once and kept with the stream.
+    """
+    if obj_stream.offsets is None:
+        data = obj_stream['stream']
+        offsets = {}
+        try:
+            first = int(obj_stream['entries']['/First'])
+            header = data[:first].split()
+            for i in range(0, len(header) - 1, 2):
+                offsets[int(header[i])] = first + int(header[i+1])
+        except (KeyError, ValueError):
+            offsets = {}
+        obj_stream.offsets = offsets
+    return obj_stream.offsets
+
+
 def parse_object_stream(obj_stream: Stream, env_num) -> tuple:
     """List objects embedded within an object stream (/ObjStm)."""
     res = []
@@ -337,6 +598,20 @@ def parse_xref_table_raw(bdata: bytes, start_pos: int=0) -> tuple:
     bl, el = next_line(bdata, start_pos+len(XREF))
     bo = bl
     while b'0' <= bdata[bl:bl+1] <= b'9':
+        m = XREF_SUBSECTION.match(bdata, bl)
+        if m:
+            #Fast path: a subsection made of well-formed 20-byte entries
+            o_num, nb = int(m[1]), int(m[2])
+            res.append((o_num, nb))
+            b0, _ = next_line(bdata, m.end())
+            if b0 is not None and nb > 0 and XREF_ENTRIES.fullmatch(bdata, b0, b0 + 20 * nb):
+                items = bdata[b0:b0 + 20 * nb].split()
+                res.extend(zip(map(int, items[0::3]), range(o_num, o_num + nb), map(int, items[1::3]), items[2::3]))
+                o_num += nb
+                bl, el = next_line(bdata, b0 + 20 * nb)
+            else:
+                bl, el = next_line(bdata, m.end())
+            continue
         items = bdata[bl:el].strip(b' ').split()
         if len(items) == 2: #subsection
             o_num, nb = int(items[0]), int(items[1])
@@ -348,8 +623,7 @@ def parse_xref_table_raw(bdata: bytes, start_pos: int=0) -> tuple:
             res.append((offset, o_num, o_ver, keyword))
             o_num += 1
         bl, el = next_line(bdata, el)
-    bl, bf, _l = next_token(bdata, el)
-    trailer = parse_obj(bdata, bl)
+    bl, bf, trailer = next_obj(bdata, el)
     return (start_pos, bf, 'XREFTABLE', {'table':res, 'trailer':trailer})
 
 
@@ -369,38 +643,71 @@ def expand_xref_index(xref_index: list) -> list:
     return res
 
 
-def parse_xref_stream_raw(xref_stream: Stream, start_pos=None) -> tuple:
-    """."""
+def xref_stream_column(data: bytes, offset: int, width: int, row_len: int, nb_rows: int) -> list:
+    """Decode one big-endian column of an xref stream for all rows at once."""
+    if width == 0:
+        return [0] * nb_rows
+    size = 1
+    while size < width:
+        size *= 2
+    if size > 8:
+        return [int.from_bytes(data[i:i+width], byteorder='big')
+                for i in range(offset, offset + nb_rows * row_len, row_len)]
+    end = nb_rows * row_len
+    buf = bytearray(size * nb_rows)
+    for b in range(width):
+        #byte plane b of the column, placed at its big-endian position
+        buf[size-width+b::size] = data[offset+b:end:row_len]
+    if size == 1:
+        return list(buf)
+    typecode = {2: 'H', 4: 'I' if array('I').itemsize == 4 else 'L', 8: 'Q'}[size]
+    col = array(typecode, bytes(buf))
+    if sys.byteorder == 'little':
+        col.byteswap()
+    return col.tolist()
+
+
+def parse_xref_stream_raw(xref_stream: Stream, start_pos=None, pretty=False) -> tuple:
+    """Decode the rows of an xref stream, column by column.
+
+    The hex representation of each row is only built if pretty is True.
+    """
     res = []
-    cols = xref_stream['entries']['/W']
-    i = 0
+    data = xref_stream['stream']
+    cols = [int(w) for w in xref_stream['entries']['/W']]
     if '/Index' in xref_stream['entries']:
         obj_range = xref_stream['entries']['/Index']
     else:
         obj_range = [0, xref_stream['entries']['/Size']]
     obj_nums = expand_xref_index(obj_range)
-    while i < len(xref_stream['stream']):
-        params = []
-        ppr = b''
-        obj_num, subsection = obj_nums.pop(0)
-        for col in cols:
-            x = xref_stream['stream'][i:i+int(col)]
-            #struct.unpack cannot work with 3-byte words
-            params.append(int.from_bytes(x, byteorder='big'))
-            i += int(col)
-            ppr += asciihex(x) + b' '
-        if params[0] == 0:
-            offset = params[1]
-            o_gen = params[2]
-            res.append((offset, None, obj_num, o_gen, b'f', ppr, subsection))
-        elif params[0] == 1:
-            offset = params[1]
-            o_gen = params[2]
-            res.append((offset, None, obj_num, o_gen, b'n', ppr, subsection))
-        elif params[0] == 2:
-            env_num = params[1]
-            o_pos = params[2]
-            res.append((o_pos, env_num, obj_num, 0, b'n', ppr, subsection))
+    row_len = sum(cols)
+    if row_len == 0:
+        return (start_pos, None, 'XREFSTREAM', {'table': res, 'trailer': xref_stream['entries']})
+    nb_rows = min(len(data) // row_len, len(obj_nums))
+    columns = []
+    offset = 0
+    for width in cols + [0] * (3 - len(cols)):
+        columns.append(xref_stream_column(data, offset, width, row_len, nb_rows))
+        offset += width
+    if cols[0] == 0:
+        columns[0] = [1] * nb_rows
+    types, fields1, fields2 = columns[:3]
+    for r in range(nb_rows):
+        obj_num, subsection = obj_nums[r]
+        if pretty:
+            ppr = b''
+            i = r * row_len
+            for col in cols:
+                ppr += asciihex(data[i:i+col]) + b' '
+                i += col
+        else:
+            ppr = None
+        if types[r] == 0:
+            res.append((fields1[r], None, obj_num, fields2[r], b'f', ppr, subsection))
+        elif types[r] == 1:
+            res.append((fields1[r], None, obj_num, fields2[r], b'n', ppr, subsection))
+        elif types[r] == 2:
+            res.append((fields2[r], fields1[r], obj_num, 0, b'n', ppr, subsection))
     return (start_pos, None, 'XREFSTREAM', {'table': res, 'trailer': xref_stream['entries']})
 
 
@@ -462,39 +769,47 @@ def to_str(obj) -> bytes:
 
 def serialize(obj, depth=0) -> bytes:
     """Recursively construct object bytes."""
-    ret = b''
-    content = None
-    if type(obj) == dict or type(obj) == Stream:
-        if type(obj) == Stream:
+    out = []
+    serialize_into(obj, out, depth)
+    return b''.join(out)
+
+
+def serialize_into(obj, out: list, depth=0) -> None:
+    """Append object bytes fragments to out, joined once by the caller."""
+    t = type(obj)
+    if t == str:
+        out.append(obj.encode('ascii'))
+    elif t == complex:
+        out.append(f'{int(obj.imag)} {int(obj.real)} R'.encode('ascii'))
+    elif t == int or t == float:
+        out.append(str(obj).encode('ascii'))
+    elif t == dict or t == Stream:
+        content = None
+        if t == Stream:
             content = obj['encoded']
             obj = obj['entries']
-        ret += b'<< '
-        keys = list(obj.keys())
-        for i in keys:
-            name = i
-            value = serialize(obj[i], depth + 1)
-            ret += b' '  * depth
-            ret += to_str(name)
-            ret += b' '
-            ret += value
-            ret += b' '
-        ret += b' ' * depth
-        ret += b'>>'
+        indent = b' ' * depth
+        out.append(b'<< ')
+        for name, value in obj.items():
+            out.append(indent)
+            out.append(to_str(name))
+            out.append(b' ')
+            serialize_into(value, out, depth + 1)
+            out.append(b' ')
+        out.append(indent)
+        out.append(b'>>')
         if content:
-            ret += b'\nstream\n'
-            #ret += b'\n'
-            ret += content
-            ret += b'\nendstream'
-    elif type(obj) == list:
-        ret += b'[ '
+            out.append(b'\nstream\n')
+            out.append(content)
+            out.append(b'\nendstream')
+    elif t == list:
+        out.append(b'[ ')
         for i in obj:
-            value = serialize(i)
-            ret += value
-            ret += b' '
-        ret += b']'        
+            serialize_into(i, out)
+            out.append(b' ')
+        out.append(b']')
     else:
-        ret += to_str(obj)
-    return ret
+        out.append(to_str(obj))
 
 
 def deep_ref_retarget(obj: Any, mapping: dict) -> Any:
@@ -502,6 +817,8 @@ def deep_ref_retarget(obj: Any, mapping: dict) -> Any:
     if type(obj) == complex:
         if obj in mapping:
             return mapping[obj]
+    elif type(obj) == Stream:
+        deep_ref_retarget(obj.entries, mapping)
     elif type(obj) == dict:
         for k in obj:
             obj[k] = deep_ref_retarget(obj[k], mapping)
@@ -511,18 +828,45 @@ def deep_ref_retarget(obj: Any, mapping: dict) -> Any:
     return obj
 
 
-def deep_ref_detect(obj: Any, l = None) -> set:
-    """Recursively detect all references in object tree."""
+def deep_ref_remap(obj: Any, mapping: dict) -> Any:
+    """Recursively replace indirect references, returning copies only where needed.
+
+    Unmapped references become null. Parts of the tree without any
+    reference are shared with the original object.
+    """
+    if type(obj) == complex:
+        return mapping.get(obj, 'null')
+    elif type(obj) == Stream:
+        entries = deep_ref_remap(obj.entries, mapping)
+        if entries is obj.entries:
+            return obj
+        return Stream(entries, obj._stream, obj.encoded)
+    elif type(obj) == dict:
+        new_obj = {k: deep_ref_remap(v, mapping) for k, v in obj.items()}
+        if all(new_obj[k] is obj[k] for k in obj):
+            return obj
+        return new_obj
+    elif type(obj) == list:
+        new_obj = [deep_ref_remap(v, mapping) for v in obj]
+        if all(x is y for x, y in zip(new_obj, obj)):
+            return obj
+        return new_obj
+    return obj
+
+
+def deep_ref_detect(obj: Any, l = None, skip = ()) -> set:
+    """Recursively detect all references in object tree, ignoring dict keys in skip."""
     if l is None:
         l = set()
     if type(obj) == complex:
         return l.add(obj)
     elif type(obj) == Stream:
-            deep_ref_detect(obj['entries'], l)
+            deep_ref_detect(obj['entries'], l, skip)
     elif type(obj) == dict:
         for k in obj:
-            deep_ref_detect(obj[k], l)
+            if k not in skip:
+                deep_ref_detect(obj[k], l, skip)
     elif type(obj) == list:
         for k in range(len(obj)):
-            deep_ref_detect(obj[k], l)
+            deep_ref_detect(obj[k], l, skip)
     return l
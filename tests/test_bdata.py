@@ -1,6 +1,23 @@
+import gc
+import io
+import os
+import tempfile
+import weakref
 import unittest
 import pdfsyntax as pdf
 
+
+class CountingReader(io.BytesIO):
+
+    def __init__(self, data):
+        super().__init__(data)
+        self.reads = 0
+
+    def read(self, size=-1):
+        self.reads += 1
+        return super().read(size)
+
+
 class Bdata(unittest.TestCase):
 
     @classmethod
@@ -14,6 +31,9 @@ class Bdata(unittest.TestCase):
         f2 = open('./samples/simple_text_string.pdf', 'rb')
         cls.f["file"] = f2
         cls.f["CONTINUOUS"] = pdf.bdata_provider(f2, 'CONTINUOUS')
+        f3 = open('./samples/simple_text_string.pdf', 'rb')
+        cls.f["MMAP"] = pdf.bdata_provider(f3, 'MMAP')
+        f3.close()
 
     def test_read_data(self):
         data = pdf.bdata_provider(b'0123456789')
@@ -39,7 +59,90 @@ class Bdata(unittest.TestCase):
     def test_all_continuous(self):
         self.assertEqual(len(pdf.bdata_all(self.f["CONTINUOUS"])), 866)
 
+    def test_read_continuous(self):
+        buf, i, o, n = self.f["CONTINUOUS"](-7, -1)
+        self.assertEqual((o + i, buf[i:i+n]), (859, b'%%EOF\n\n'))
+
+    def test_block_cache(self):
+        f = CountingReader(bytes(range(100)))
+        data = pdf.bdata_provider(f, 'CONTINUOUS', 10, 4)
+        buf, i, o, n = data(15, 20)
+        self.assertEqual(buf[i:i+n], bytes(range(15, 35)))
+        data(22, 5)
+        self.assertEqual(f.reads, 1)
+
+    def test_block_cache_coalescing(self):
+        f = CountingReader(bytes(range(100)))
+        data = pdf.bdata_provider(f, 'CONTINUOUS', 10, 8)
+        data(30, 5)
+        buf, i, o, n = data(5, 50)
+        self.assertEqual((o + i, buf[i:i+n]), (5, bytes(range(5, 55))))
+        self.assertEqual(f.reads, 3)
+
+    def test_load_continuous(self):
+        with open('./samples/simple_text_string.pdf', 'rb') as f:
+            doc = pdf.load(f, 'CONTINUOUS')
+            self.assertEqual(pdf.flat_page_tree(doc), [(4j, {})])
+
+    def test_readfile_continuous(self):
+        doc = pdf.readfile('./samples/simple_text_string.pdf', 'CONTINUOUS')
+        self.assertEqual(pdf.flat_page_tree(doc), [(4j, {})])
+        fdata = weakref.ref(doc.data[0]['fdata'])
+        del doc
+        gc.collect()
+        self.assertIsNone(fdata())
+
+    def test_length_mmap(self):
+        self.assertEqual(pdf.bdata_length(self.f["MMAP"]), 866)
+
+    def test_all_mmap(self):
+        self.assertEqual(len(pdf.bdata_all(self.f["MMAP"])), 866)
+
+    def test_read_mmap(self):
+        buf, i, o, n = self.f["MMAP"](-7, -1)
+        self.assertEqual(buf[i:i+n], b'%%EOF\n\n')
+
+    def test_mmap_fallback(self):
+        data = pdf.bdata_provider(b'0123456789', 'MMAP')
+        self.assertEqual(data(5, 3),(b'0123456789', 5, 0, 3))
+
+    def test_load_mmap(self):
+        doc = pdf.readfile('./samples/simple_text_string.pdf', 'MMAP')
+        self.assertEqual(pdf.flat_page_tree(doc), [(4j, {})])
+
     @classmethod
     def tearDownClass(cls):
         cls.f["file"].close()
 
+
+
+class ContinuousFile(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp = tempfile.TemporaryDirectory()
+        cls.path = os.path.join(cls.tmp.name, 'big.pdf')
+        doc = pdf.readfile('./samples/simple_text_string.pdf')
+        with pdf.edit(doc) as session:
+            for i in range(1200):
+                session.add({'/Filler': '/' + 'x' * 1000, '/Num': i})
+        pdf.writefile(session.doc, cls.path)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp.cleanup()
+
+    def test_beyond_cache(self):
+        self.assertGreater(os.path.getsize(self.path), 256 * 4096)
+        doc = pdf.readfile(self.path, 'CONTINUOUS')
+        ref = pdf.readfile(self.path)
+        nums = range(1, len(ref.index[-1]))
+        for num in nums:
+            self.assertEqual(pdf.get_object(doc, complex(0, num)), pdf.get_object(ref, complex(0, num)))
+        with open(self.path, 'rb') as f:
+            content = f.read()
+        fdata = doc.data[0]['fdata']
+        for num in reversed(nums):
+            pos = ref.index[-1][num]['abs_pos']
+            buf, i, _, n = fdata(pos, 20)
+            self.assertEqual(buf[i:i+n], content[pos:pos+20])
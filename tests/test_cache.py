@@ -0,0 +1,160 @@
+import io
+import os
+import shutil
+import tempfile
+import unittest
+import pdfsyntax as pdf
+
+class BoundedCache(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.doc = pdf.readfile('./samples/add_text_annotation.pdf')
+
+    def test_unbounded(self):
+        self.assertEqual(pdf.cache_stats(self.doc), None)
+
+    def test_same_objects(self):
+        doc = pdf.readfile('./samples/add_text_annotation.pdf', policy={'max_entries': 2})
+        for _ in range(2):
+            for iref in pdf.in_use(self.doc):
+                self.assertEqual(pdf.get_object(doc, iref), pdf.get_object(self.doc, iref))
+        stats = pdf.cache_stats(doc)
+        self.assertEqual(stats['entries'], 2)
+        self.assertGreater(stats['evictions'], 0)
+
+    def test_max_bytes(self):
+        doc = pdf.readfile('./samples/add_text_annotation.pdf', policy={'max_bytes': 1000})
+        for iref in pdf.in_use(doc):
+            pdf.get_object(doc, iref)
+        self.assertLessEqual(pdf.cache_stats(doc)['bytes'], 1000)
+
+    def test_pinned(self):
+        doc = pdf.readfile('./samples/add_text_annotation.pdf', policy={'max_entries': 0})
+        cat, cat_iref = pdf.catalog(doc)
+        pages_iref = cat['/Pages']
+        for iref in pdf.in_use(doc):
+            pdf.get_object(doc, iref)
+        self.assertIsNotNone(doc.cache[int(cat_iref.imag)])
+        self.assertIsNotNone(doc.cache[int(pages_iref.imag)])
+
+    def test_hits(self):
+        doc = pdf.readfile('./samples/add_text_annotation.pdf', policy={'max_entries': 10})
+        pdf.number_pages(doc)
+        hits = pdf.cache_stats(doc)['hits']
+        pdf.number_pages(doc)
+        self.assertGreater(pdf.cache_stats(doc)['hits'], hits)
+
+    def test_updated_object_kept(self):
+        doc = pdf.readfile('./samples/add_text_annotation.pdf', policy={'max_entries': 0})
+        doc = pdf.rotate(doc, 90)
+        for iref in pdf.in_use(doc):
+            pdf.get_object(doc, iref)
+        self.assertEqual(pdf.page_layouts(doc)[0][1], 90)
+
+
+class ObjectStream(unittest.TestCase):
+
+    def test_offsets(self):
+        s = pdf.Stream({'/Type': '/ObjStm', '/N': 2, '/First': 8}, b'4 0 5 4 (a) [1]', b'')
+        self.assertEqual(pdf.object_stream_offsets(s), {4: 8, 5: 12})
+
+    def test_embedded_objects(self):
+        doc = pdf.compress(pdf.readfile('./samples/add_text_annotation.pdf'))
+        new_doc = pdf.loads(doc.data[-2]['bdata'])
+        for iref in pdf.in_use(new_doc):
+            obj = pdf.get_object(new_doc, iref)
+            if 'env_num' in new_doc.index[-1][int(iref.imag)]:
+                self.assertEqual(obj, pdf.get_object(doc, iref))
+
+
+class ChunkedList(unittest.TestCase):
+
+    def test_list(self):
+        items = list(range(3000))
+        cl = pdf.ChunkedList(items[:1500])
+        cl += items[1500:2999]
+        cl.append(2999)
+        self.assertEqual(cl, items)
+        self.assertEqual(cl[-1], 2999)
+        self.assertEqual(cl[1020:1030], items[1020:1030])
+
+    def test_copy_on_write(self):
+        cl = pdf.ChunkedList(range(3000))
+        new_cl = cl.copy()
+        new_cl[5] = None
+        new_cl.append(None)
+        cl[2500] = None
+        self.assertEqual((cl[5], new_cl[5]), (5, None))
+        self.assertEqual((cl[2500], new_cl[2500]), (None, 2500))
+        self.assertEqual((len(cl), len(new_cl)), (3000, 3001))
+        self.assertIs(cl.chunks[1], new_cl.chunks[1])
+
+    def test_shared_by_edit(self):
+        doc = pdf.readfile('./samples/add_text_annotation.pdf')
+        new_doc = pdf.update_object(doc, 1, {})
+        self.assertIsNot(doc.cache[1], new_doc.cache[1])
+        self.assertIs(doc.cache[0], new_doc.cache[0])
+
+
+class IndexCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.cache = {'dir': os.path.join(self.tmp, 'cache')}
+        self.path = os.path.join(self.tmp, 'doc.pdf')
+        shutil.copy('./samples/add_text_annotation.pdf', self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_same_index(self):
+        doc = pdf.readfile(self.path)
+        for _ in range(2):
+            cached_doc = pdf.readfile(self.path, index_cache=self.cache)
+            self.assertEqual(cached_doc.index, doc.index)
+            self.assertEqual(pdf.metadata(cached_doc), pdf.metadata(doc))
+            self.assertEqual(cached_doc.cache[0], doc.cache[0])
+        self.assertEqual(len(os.listdir(self.cache['dir'])), 1)
+
+    def test_trailer(self):
+        doc = pdf.readfile(self.path, index_cache=self.cache)
+        trailer = {'/Root': 1j, '/Info': complex(2, 9), '/ID': [b'<0a1b>', b'(a\\)b\xe9)'],
+                   '/Size': 10, '/Version': 1.5, '/Encrypt': {'/EncryptMetadata': False, '/Filter': '/Standard'}}
+        data = pdf.encode_index_cache('fp', doc.index, trailer)
+        self.assertEqual(pdf.decode_index_cache(data, 'fp'), (doc.index, trailer))
+        self.assertRaises(ValueError, pdf.encode_index_cache, 'fp', doc.index, {'/Root': (1, 0)})
+
+    def test_stale_entry(self):
+        pdf.readfile(self.path, index_cache=self.cache)
+        doc = pdf.rotate(pdf.readfile(self.path), 90)
+        pdf.writefile(doc, self.path)
+        cached_doc = pdf.readfile(self.path, index_cache=self.cache)
+        self.assertEqual(cached_doc.index, pdf.readfile(self.path).index)
+        self.assertEqual(pdf.page_layouts(cached_doc)[0][1], 90)
+
+    def test_max_bytes(self):
+        pdf.readfile(self.path, index_cache=self.cache)
+        size = os.path.getsize(os.path.join(self.cache['dir'], os.listdir(self.cache['dir'])[0]))
+        os.utime(self.path, ns=(0, 0))
+        self.cache['max_bytes'] = size
+        pdf.readfile(self.path, index_cache=self.cache)
+        self.assertEqual(len(os.listdir(self.cache['dir'])), 1)
+
+    def test_corrupted_entry(self):
+        doc = pdf.readfile(self.path, index_cache=self.cache)
+        with open(self.path, 'rb') as f:
+            fingerprint = pdf.file_fingerprint(f, pdf.bdata_provider(f))
+        sidecar = pdf.index_cache_path(self.cache['dir'], fingerprint)
+        with open(sidecar, 'rb') as f:
+            data = f.read()
+        for bad in (data[:-3], b'\x80\x04K\x01.', data.replace(b'"format":', b'"formats":')):
+            with open(sidecar, 'wb') as f:
+                f.write(bad)
+            self.assertIsNone(pdf.read_index_cache(self.cache['dir'], fingerprint))
+            self.assertEqual(pdf.readfile(self.path, index_cache=self.cache).index, doc.index)
+
+    def test_stream_not_cached(self):
+        with open(self.path, 'rb') as f:
+            pdf.load(io.BytesIO(f.read()), index_cache=self.cache)
+        self.assertFalse(os.path.exists(self.cache['dir']))
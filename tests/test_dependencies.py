@@ -21,3 +21,18 @@ class Dependencies(unittest.TestCase):
 
     def test_str(self):
         self.assertEqual(pdf.dependencies(self.doc, b'test'), set())
+
+    def test_cycle(self):
+        doc, a = pdf.add_object(self.doc, [])
+        doc, b = pdf.add_object(doc, [a, 5j])
+        doc = pdf.update_object(doc, int(a.imag), [b])
+        self.assertEqual(pdf.dependencies(doc, a), {a, b, 5j})
+
+    def test_memoized_edges(self):
+        pdf.dependencies(self.doc, 4j)
+        self.assertIsNotNone(self.doc.cache.edge(4))
+        doc = pdf.update_object(self.doc, 4, {'/Type': '/Page'})
+        self.assertIsNone(doc.cache.edge(4))
+        self.assertEqual(pdf.dependencies(doc, 4j), {4j})
+        self.assertEqual(pdf.dependencies(self.doc, 4j), {4j, 5j, 6j, 7j})
+        self.assertEqual(doc.cache.edge(5), self.doc.cache.edge(5))
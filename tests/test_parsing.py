@@ -63,3 +63,47 @@ class Parsing(unittest.TestCase):
 
     def test_delimiter_in_content(self):
         self.assertEqual(pdf.parse_obj(b'[BT /F1 12 Tf 123.45 200 Td [(text1)-5(])] TJ ET]'), ['BT', '/F1', 12, 'Tf', 123.45, 200, 'Td', [b'(text1)', -5, b'(])'], 'TJ', 'ET'])
+
+    def test_leading_space_dictionary(self):
+        self.assertEqual(pdf.parse_obj(b'  <</abc 1>>'), {'/abc': 1})
+
+    def test_string_in_dictionary(self):
+        self.assertEqual(pdf.parse_obj(b'<< /a (x>>y) /b 2 >>'), {'/a': b'(x>>y)', '/b': 2})
+
+    def test_deep_nesting(self):
+        self.assertEqual(pdf.parse_obj(b'[[[<</a [1 <</b 2>>]>>]]]'), [[[{'/a': [1, {'/b': 2}]}]]])
+
+    def test_next_obj(self):
+        self.assertEqual(pdf.next_obj(b'1 0 obj [ 1 [2] ] endobj', 7), (8, 17, [1, [2]]))
+
+    def test_next_obj_stream(self):
+        self.assertEqual(pdf.next_obj(b'<< /a 1 >>\nstream\nxyz\nendstream\nendobj')[1], 31)
+
+    def test_stream_length(self):
+        text = b'<< /Length 13 >>\nstream\nabc endstream\nendstream\nendobj'
+        self.assertEqual(pdf.parse_obj(text)['encoded'], b'abc endstream')
+
+    def test_stream_length_trailing_eol(self):
+        text = b'<< /Length 4 >>\nstream\nabc\r\nendstream\nendobj'
+        self.assertEqual(pdf.parse_obj(text)['encoded'], b'abc\r')
+        text = b'<< /Length 4 >>\nstream\nabc\n\r\nendstream\nendobj'
+        self.assertEqual(pdf.parse_obj(text)['encoded'], b'abc\n')
+        text = b'<< /Length 4 >>\nstream\nabc\nendstream\nendobj'
+        self.assertEqual(pdf.parse_obj(text)['encoded'], b'abc\n')
+
+    def test_stream_wrong_length(self):
+        text = b'<< /Length 99 >>\nstream\nabc\nendstream\nendobj'
+        self.assertEqual(pdf.parse_obj(text)['encoded'], b'abc')
+
+    def test_stream_indirect_length(self):
+        text = b'<< /Length 5 0 R >>\nstream\nabc endstream\nendstream\nendobj'
+        self.assertEqual(pdf.parse_obj(text, 0, lambda ref: 13)['encoded'], b'abc endstream')
+
+    def test_stream_lazy_decoding(self):
+        import zlib
+        encoded = zlib.compress(b'abc')
+        text = b'<< /Filter /FlateDecode /Length ' + str(len(encoded)).encode() + b' >>\nstream\n' + encoded + b'\nendstream'
+        s = pdf.parse_obj(text)
+        self.assertIsNone(s._stream)
+        self.assertEqual(s['stream'], b'abc')
+        self.assertEqual(s._stream, b'abc')
@@ -1,3 +1,6 @@
+import io
+import os
+import tempfile
 import unittest
 import pdfsyntax as pdf
 
@@ -8,3 +11,115 @@ class Serialization(unittest.TestCase):
 
     def test_dict(self):
         self.assertEqual(pdf.serialize({'/abc': 123, '/def': True}), b'<< /abc 123 /def true >>')
+
+    def test_nested(self):
+        obj = {'/Kids': [3j, 4j], '/Sub': {'/F': 1.5, '/S': b'(x)'}, '/A': [[1], {'/N': False}]}
+        ser = b'<< /Kids [ 3 0 R 4 0 R ] /Sub <<  /F 1.5  /S (x)  >> /A [ [ 1 ] << /N false >> ] >>'
+        self.assertEqual(pdf.serialize(obj), ser)
+
+    def test_stream(self):
+        s = pdf.Stream({'/Length': 3}, b'abc', b'abc')
+        self.assertEqual(pdf.serialize(s), b'<< /Length 3 >>\nstream\nabc\nendstream')
+
+    def test_fragment(self):
+        block = pdf.filestruct.serialize_fragment(7, 0, {'/A': 7j})
+        self.assertEqual(block, b'7 0 obj\n<< /A 7 0 R >>\nendobj\n')
+
+
+class Dump(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.doc = pdf.rotate(pdf.readfile('./samples/add_text_annotation.pdf'), 90)
+
+    def test_same_as_writefile(self):
+        b = io.BytesIO()
+        pdf.dump(self.doc, b)
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'out.pdf')
+            pdf.writefile(self.doc, path)
+            with open(path, 'rb') as f:
+                self.assertEqual(f.read(), b.getvalue())
+
+    def test_chunks(self):
+        b = io.BytesIO()
+        pdf.dump(self.doc, b)
+        write_chunk = pdf.api.WRITE_CHUNK
+        pdf.api.WRITE_CHUNK = 100
+        try:
+            b2 = io.BytesIO()
+            pdf.dump(self.doc, b2)
+        finally:
+            pdf.api.WRITE_CHUNK = write_chunk
+        self.assertEqual(b.getvalue(), b2.getvalue())
+
+    def test_reload(self):
+        b = io.BytesIO()
+        pdf.dump(self.doc, b)
+        doc = pdf.loads(b.getvalue())
+        self.assertEqual(pdf.page_layouts(doc), pdf.page_layouts(self.doc))
+
+
+class Append(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'doc.pdf')
+        with open('./samples/simple_text_string.pdf', 'rb') as f:
+            self.original = f.read()
+        with open(self.path, 'wb') as f:
+            f.write(self.original)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_same_as_full_write(self):
+        doc = pdf.rotate(pdf.readfile(self.path), 90)
+        b = io.BytesIO()
+        pdf.dump(doc, b)
+        pdf.writefile(doc, self.path, append=True)
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        self.assertEqual(data, b.getvalue())
+        self.assertEqual(data[:len(self.original)], self.original)
+
+    def test_changed_file(self):
+        doc = pdf.rotate(pdf.readfile(self.path), 90)
+        with open(self.path, 'ab') as f:
+            f.write(b'\n')
+        self.assertRaises(ValueError, pdf.writefile, doc, self.path, True)
+
+    def test_trailing_bytes(self):
+        with open(self.path, 'ab') as f:
+            f.write(b' \x00 ')
+        doc = pdf.rotate(pdf.readfile(self.path), 90)
+        b = io.BytesIO()
+        pdf.dump(doc, b)
+        pdf.writefile(doc, self.path, append=True)
+        with open(self.path, 'rb') as f:
+            self.assertEqual(f.read(), b.getvalue())
+        with open(self.path, 'ab') as f:
+            f.write(b'garbage')
+        doc = pdf.rotate(pdf.readfile(self.path), 90)
+        self.assertRaises(ValueError, pdf.writefile, doc, self.path, True)
+        with open(self.path, 'rb') as f:
+            self.assertTrue(f.read().endswith(b'garbage'))
+
+    def test_memory_map(self):
+        with open(self.path, 'ab') as f:
+            f.write(b' ' * 60)
+        with open(self.path, 'rb') as f:
+            doc = pdf.commit(pdf.rotate(pdf.load(f, 'MMAP'), 90))
+            small_doc = pdf.Doc(doc.index, doc.cache, [dict(d) for d in doc.data])
+            small_doc.data[-2]['bdata'] = b'\n'
+            self.assertRaises(ValueError, pdf.writefile, small_doc, self.path, True)
+            fdata = doc.data[0]['fdata']
+            small_doc.data[0]['fdata'] = lambda start_pos, length: fdata(start_pos, length)
+            self.assertRaises(ValueError, pdf.writefile, small_doc, self.path, True)
+            self.assertEqual(os.path.getsize(self.path), len(self.original) + 60)
+            pdf.writefile(doc, self.path, append=True)
+            self.assertEqual(pdf.page_layouts(pdf.readfile(self.path)), pdf.page_layouts(doc))
+            self.assertEqual(pdf.metadata(doc), pdf.metadata(pdf.readfile('./samples/simple_text_string.pdf')))
+
+    def test_blank_doc(self):
+        self.assertRaises(ValueError, pdf.writefile, pdf.blank(), self.path, True)
@@ -17,3 +17,44 @@ class SimpleFile(unittest.TestCase):
     def test_page_list(self):
         self.assertEqual(pdf.flat_page_tree(self.doc), [(4j, {})])
 
+    def test_page_ref(self):
+        self.assertEqual(pdf.page_ref(self.doc, 0), 4j)
+        self.assertEqual(pdf.page_ref(self.doc, -1), 4j)
+
+    def test_page_tree_descent(self):
+        doc = self.doc
+        for _ in range(3):
+            doc = pdf.concat(doc, doc)
+        pages = pdf.flat_page_tree(doc)
+        self.assertEqual(len(pages), 8)
+        for i in range(-8, 8):
+            self.assertEqual(pdf.descend_page_tree(doc, i), pages[i][0])
+        self.assertRaises(IndexError, pdf.descend_page_tree, doc, 8)
+
+    def test_page_list_copy(self):
+        pdf.flat_page_tree(self.doc)[0][1]['/Rotate'] = 90
+        self.assertEqual(pdf.flat_page_tree(self.doc), [(4j, {})])
+
+    def test_page_list_inherited_copy(self):
+        node = pdf.get_object(self.doc, 3j)
+        node['/MediaBox'] = [0, 0, 612, 792]
+        doc = pdf.update_object(self.doc, 3, node)
+        pdf.flat_page_tree(doc)[0][1]['/MediaBox'][2] = 0
+        self.assertEqual(pdf.flat_page_tree(doc), [(4j, {'/MediaBox': [0, 0, 612, 792]})])
+        self.assertEqual(pdf.get_object(doc, 3j, mutable=False)['/MediaBox'], [0, 0, 612, 792])
+
+    def test_page_list_invalidation(self):
+        pdf.flat_page_tree(self.doc)
+        new_doc = pdf.concat(self.doc, self.doc)
+        self.assertEqual(len(pdf.flat_page_tree(new_doc)), 2)
+        self.assertEqual(len(pdf.flat_page_tree(self.doc)), 1)
+
+
+    def test_read_only_object(self):
+        cat, iref = pdf.catalog(self.doc, mutable=False)
+        self.assertIs(cat, pdf.get_object(self.doc, iref, mutable=False))
+
+    def test_mutable_object(self):
+        cat, iref = pdf.catalog(self.doc)
+        cat['/Version'] = '/2.0'
+        self.assertNotIn('/Version', pdf.get_object(self.doc, iref, mutable=False))
@@ -1,5 +1,7 @@
 
+import random
 import unittest
+from unittest import mock
 import pdfsyntax as pdf
 
 class Tokenization(unittest.TestCase):
@@ -75,3 +77,34 @@ class Tokenization(unittest.TestCase):
 
     def test_line2(self):
         self.assertEqual(pdf.next_line(b'\n\rabc\n\rdef\n\r', 6), (7, 10))
+
+class TableTokenization(unittest.TestCase):
+
+    def test_same_as_bytewise(self):
+        with open('./samples/add_text_annotation.pdf', 'rb') as f:
+            data = f.read()
+        for i in range(len(data)):
+            self.assertEqual(pdf.next_token_table(data, i), pdf.next_token_bytewise(data, i))
+
+    def test_same_as_bytewise_edge_cases(self):
+        cases = [b'[1 %]\n 2] ', b'[1 < 2] ', b'[(a\\)] b)] ', b'<< /a (x>>y) >> ', b'<</a<41>>> ',
+                 b'<<<41> /b 1>> >> ', b'(a\\) ', b'(a\\\)) ', b'<41\>42> ', b'stream\r\nendstream ']
+        for data in cases:
+            for i in range(len(data) + 1):
+                self.assertEqual(pdf.next_token_table(data, i), pdf.next_token_bytewise(data, i))
+
+    def test_same_as_bytewise_generated(self):
+        fragments = [b'[', b']', b'<<', b'>>', b'<', b'>', b'(', b')', b'\\', b'%', b'\n', b'\r', b' ',
+                     b'/a', b'1', b'.5', b'true', b'false', b'R', b'stream\n', b'endstream', b'}', b'\xe9']
+        rnd = random.Random(0)
+        for _ in range(2000):
+            data = b''.join(rnd.choice(fragments) for _ in range(rnd.randint(1, 12)))
+            for i in range(len(data) + 1):
+                self.assertEqual(pdf.next_token_table(data, i), pdf.next_token_bytewise(data, i))
+
+    def test_parser_follows_tokenizer(self):
+        data = b'<< /Kids [1 0 R (a]) <41>] /Sub << /b true >> /c -1.5 >> '
+        obj = pdf.parse_obj(data)
+        with mock.patch.object(pdf.objects, 'TOKENIZER', 'BYTEWISE'):
+            with mock.patch.object(pdf.objects, 'next_token_table', side_effect=AssertionError):
+                self.assertEqual(pdf.parse_obj(data), obj)
@@ -1,4 +1,5 @@
 
+import io
 import unittest
 import pdfsyntax as pdf
 
@@ -14,3 +15,159 @@ class Updating(unittest.TestCase):
     def test_prev(self):
         self.assertEqual('/Prev' in self.doc.cache[0], True)
 
+
+
+class EditSession(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.doc = pdf.readfile('./samples/simple_text_string.pdf')
+
+    def test_batch(self):
+        with pdf.edit(self.doc) as session:
+            iref = session.add({'/Type': '/Test'})
+            obj = session.get(iref)
+            obj['/Value'] = 1
+            session.update(int(iref.imag), obj)
+        self.assertEqual(pdf.get_object(session.doc, iref), {'/Type': '/Test', '/Value': 1})
+        self.assertEqual(len(pdf.changes(session.doc)), 1)
+
+    def test_original_unchanged(self):
+        with pdf.edit(self.doc) as session:
+            session.delete(1)
+        self.assertIsNone(pdf.get_object(session.doc, 1j))
+        self.assertIsNotNone(pdf.get_object(self.doc, 1j))
+        self.assertEqual(pdf.changes(self.doc), [])
+
+    def test_trailer(self):
+        with pdf.edit(self.doc) as session:
+            session.set_trailer({'/Root': 1j, '/Size': 2})
+        self.assertEqual(session.doc.cache[0], {'/Root': 1j, '/Size': 2})
+        self.assertNotEqual(self.doc.cache[0], session.doc.cache[0])
+
+    def test_closed(self):
+        with pdf.edit(self.doc) as session:
+            pass
+        self.assertRaises(ValueError, session.add, {})
+        self.assertRaises(ValueError, session.set_trailer, {})
+
+
+class Burst(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        doc = pdf.readfile('./samples/simple_text_string.pdf')
+        cls.doc = pdf.concat(pdf.rotate(doc, 90), doc)
+        cls.docs = list(pdf.burst(cls.doc))
+
+    def test_nb_docs(self):
+        self.assertEqual(len(self.docs), 2)
+        self.assertEqual([pdf.number_pages(d) for d in self.docs], [1, 1])
+
+    def test_layouts(self):
+        self.assertEqual([pdf.page_layouts(d)[0] for d in self.docs], pdf.page_layouts(self.doc))
+
+    def test_text(self):
+        for d in self.docs:
+            self.assertEqual(pdf.extract_page_text(d, 0), 'Hello World\n')
+
+    def test_self_contained(self):
+        doc = self.docs[1]
+        self.assertEqual(pdf.in_use(doc), [1j, 2j, 3j] + [complex(0, n) for n in range(4, len(doc.index[-1]))])
+        self.assertEqual(pdf.get_object(doc, 3j)['/Parent'], 2j)
+
+    def test_iteration(self):
+        docs = [d for d in self.doc]
+        self.assertEqual([d.index for d in docs], [d.index for d in self.docs])
+        self.assertEqual([pdf.page_layouts(d)[0] for d in docs], pdf.page_layouts(self.doc))
+
+    def test_single_page(self):
+        for i in range(-2, 2):
+            self.assertEqual(self.doc[i].index, self.docs[i].index)
+            self.assertEqual(self.doc[i].cache, self.docs[i].cache)
+
+
+class Merge(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.docs = [pdf.readfile('./samples/simple_text_string.pdf'), pdf.readfile('./samples/rotate_90.pdf')]
+
+    def test_pages(self):
+        doc = pdf.merge(self.docs)
+        self.assertEqual(pdf.page_layouts(doc), pdf.page_layouts(self.docs[0]) + pdf.page_layouts(self.docs[1]))
+        self.assertEqual(pdf.extract_page_text(doc, 1), 'Hello World\n')
+
+    def test_balanced_tree(self):
+        doc = pdf.merge(self.docs * 40)
+        pages = pdf.flat_page_tree(doc)
+        self.assertEqual(len(pages), 80)
+        root = pdf.get_object(doc, pdf.catalog(doc)[0]['/Pages'])
+        self.assertEqual(len(root['/Kids']), 3)
+        self.assertEqual(pdf.descend_page_tree(doc, 70), pages[70][0])
+        self.assertEqual([pdf.locate_page(doc, i) for i in range(80)], pages)
+        self.assertEqual(pdf.page_layouts(doc)[79][1], 90)
+        self.assertEqual(pdf.page_layouts(doc[79]), [pdf.page_layouts(doc)[79]])
+
+
+class Dedup(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.doc = pdf.merge([pdf.readfile('./samples/simple_text_string.pdf')] * 3)
+
+    def test_duplicates(self):
+        doc, a = pdf.add_object(self.doc, {'/A': 1})
+        doc, b = pdf.add_object(doc, {'/A': 1})
+        doc, c = pdf.add_object(doc, [a, 'x'])
+        doc, d = pdf.add_object(doc, [b, 'x'])
+        dups = pdf.duplicate_objects(doc)
+        self.assertEqual((dups[b], dups[d]), (a, c))
+
+    def test_pages_kept(self):
+        dups = pdf.duplicate_objects(self.doc)
+        for page_ref, _ in pdf.flat_page_tree(self.doc):
+            self.assertNotIn(page_ref, dups)
+
+    def test_squash(self):
+        doc = pdf.squash(self.doc, dedup=True)
+        self.assertLess(len(pdf.in_use(doc)), len(pdf.in_use(self.doc)))
+        self.assertEqual(pdf.number_pages(doc), 3)
+        for i in range(3):
+            self.assertEqual(pdf.get_page_contents(doc, i), pdf.get_page_contents(self.doc, i))
+
+    def test_compress_xref_stream(self):
+        b = io.BytesIO()
+        pdf.dump(pdf.compress(self.doc), b)
+        doc = pdf.load(io.BytesIO(b.getvalue()))
+        self.assertTrue(doc.index[0][0].get('xref_stream_num'))
+        self.assertTrue(pdf.duplicate_objects(doc))
+        b = io.BytesIO()
+        pdf.dump(pdf.compress(doc, dedup=True), b)
+        new_doc = pdf.load(io.BytesIO(b.getvalue()))
+        self.assertLess(len(pdf.in_use(new_doc)), len(pdf.in_use(doc)))
+        for i in range(3):
+            new_contents = [c.stream for c in pdf.get_page_contents(new_doc, i)]
+            self.assertEqual(new_contents, [c.stream for c in pdf.get_page_contents(self.doc, i)])
+
+
+class ParallelFilter(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.doc = pdf.merge([pdf.readfile('./samples/simple_text_string.pdf')] * 4)
+
+    def test_apply_filter(self):
+        streams = pdf.list_streams(self.doc)
+        serial = pdf.apply_filter(self.doc, streams)
+        parallel = pdf.apply_filter(self.doc, streams, workers=4)
+        for num in streams:
+            self.assertEqual(pdf.get_object(parallel, num * 1j), pdf.get_object(serial, num * 1j))
+
+    def test_compress(self):
+        serial = pdf.compress(self.doc)
+        parallel = pdf.compress(self.doc, workers=4)
+        b1, b2 = io.BytesIO(), io.BytesIO()
+        pdf.dump(serial, b1)
+        pdf.dump(parallel, b2)
+        self.assertEqual(b2.getvalue(), b1.getvalue())
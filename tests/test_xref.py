@@ -1,4 +1,6 @@
 
+import copy
+import pickle
 import unittest
 import pdfsyntax as pdf
 
@@ -20,6 +22,16 @@ class Xref(unittest.TestCase):
     def test_xref_table3(self):
         self.assertEqual(pdf.parse_xref_table(self.xt, 0, 0)[2]['abs_pos'], 456)
 
+    def test_xref_table_subsections(self):
+        xt = b'xref\r\n0 1\r\n0000000000 65535 f\r\n3 2\r\n0000000010 00000 n\r\n0000000020 00002 n\r\ntrailer\n<<>>'
+        table = pdf.parse_xref_table_raw(xt, 0)[3]['table']
+        self.assertEqual(table, [(0, 1), (0, 0, 65535, b'f'), (3, 2), (10, 3, 0, b'n'), (20, 4, 2, b'n')])
+
+    def test_xref_table_malformed(self):
+        xt = b'xref\n0 3\n0000000000 65535 f\n12 0 n\n0000000456 00000 n \ntrailer\n<<>>'
+        table = pdf.parse_xref_table_raw(xt, 0)[3]['table']
+        self.assertEqual(table[2:], [(12, 1, 0, b'n'), (456, 2, 0, b'n')])
+
     def test_xref_index_expansion(self):
         self.assertEqual(pdf.expand_xref_index([0, 6]), [(0, 0), (1, 0), (2, 0), (3, 0), (4, 0), (5, 0)])
 
@@ -29,3 +41,85 @@ class Xref(unittest.TestCase):
     def test_xref_index_expansion3(self):
         self.assertEqual(pdf.expand_xref_index([ 0, 1, 4, 3 ]), [(0, 0), (4, 1), (5, 1), (6, 1)])
 
+
+    def test_xref_stream(self):
+        data = b'\x00\x00\x00\x00\xff\xff' + b'\x01\x00\x01\x23\x00\x00' + b'\x02\x00\x00\x05\x00\x07'
+        s = pdf.Stream({'/W': [1, 3, 2], '/Size': 3}, data, b'')
+        table = pdf.parse_xref_stream_raw(s)[3]['table']
+        self.assertEqual(table[1], (291, None, 1, 0, b'n', None, 0))
+        self.assertEqual(table[2], (7, 5, 2, 0, b'n', None, 0))
+
+    def test_xref_stream_pretty(self):
+        s = pdf.Stream({'/W': [1, 2, 1], '/Index': [4, 1]}, b'\x01\x01\x00\x00', b'')
+        self.assertEqual(pdf.parse_xref_stream_raw(s, pretty=True)[3]['table'], [(256, None, 4, 0, b'n', b'01 0100 00 ', 0)])
+
+
+class RevisionIndex(unittest.TestCase):
+
+    entries = [
+        {'o_num': 0, 'o_gen': 0, 'xref_table_pos': 9},
+        {'abs_pos': 15, 'o_num': 1, 'o_gen': 0, 'o_ver': 0, 'doc_ver': 0, 'abs_next': 60},
+        None,
+        {'o_pos': 0, 'env_num': 1, 'o_num': 3, 'o_gen': 0, 'abs_pos': 15.0001, 'o_ver': 0, 'doc_ver': 0},
+        {'o_num': 4, 'o_gen': 1, 'o_ver': 2, 'doc_ver': 1, 'DELETED': True, 'OLD_REF': 5j},
+    ]
+
+    def test_entries(self):
+        self.assertEqual(list(pdf.RevisionIndex(self.entries)), self.entries)
+
+    def test_field(self):
+        idx = pdf.RevisionIndex(self.entries)
+        self.assertEqual(idx.field(3, 'abs_pos'), 15.0001)
+        self.assertEqual(type(idx.field(1, 'abs_pos')), int)
+        self.assertEqual(idx.field(2, 'o_gen'), None)
+        self.assertEqual(idx.column('DELETED'), [None, None, None, None, True])
+
+    def test_read_only(self):
+        idx = pdf.RevisionIndex(self.entries)
+        with self.assertRaises(TypeError):
+            idx[1]['abs_pos'] = 20
+        entry = dict(idx[1])
+        entry['abs_pos'] = 20
+        idx[1] = entry
+        self.assertEqual(idx.field(1, 'abs_pos'), 20)
+        idx[0]['xref_table_pos'] = 10
+        self.assertEqual(idx.field(0, 'xref_table_pos'), 10)
+
+    def test_entry_copy(self):
+        idx = pdf.RevisionIndex(self.entries)
+        for entry in (copy.copy(idx[4]), copy.deepcopy(idx[4]), pickle.loads(pickle.dumps(idx[4]))):
+            self.assertEqual(type(entry), dict)
+            self.assertEqual(entry, self.entries[4])
+            entry['o_ver'] = 3
+        self.assertEqual(idx[4]['o_ver'], 2)
+
+    def test_embedded_pos(self):
+        idx = pdf.RevisionIndex(self.entries)
+        self.assertEqual(idx.chunks[0].extras, {4: {'OLD_REF': 5j}})
+        self.assertEqual(idx.column('abs_pos'), [None, 15, None, 15.0001, None])
+        idx[3] = dict(self.entries[3], abs_pos=15.5)
+        self.assertEqual(idx[3]['abs_pos'], 15.5)
+
+    def test_add(self):
+        idx = pdf.RevisionIndex(self.entries[:2]) + [None]
+        self.assertEqual(type(idx), pdf.RevisionIndex)
+        self.assertEqual(list(idx), self.entries[:2] + [None])
+
+    def test_copy_on_write(self):
+        idx = pdf.RevisionIndex(self.entries)
+        new_idx = idx.copy()
+        self.assertTrue(new_idx.shares(idx, 1))
+        new_idx[2] = {'o_num': 2, 'o_gen': 0, 'o_ver': 0, 'doc_ver': 1}
+        self.assertFalse(new_idx.shares(idx, 1))
+        self.assertEqual(idx[2], None)
+        self.assertEqual(new_idx.unshared(idx), [1, 2, 3, 4])
+
+    def test_large_index(self):
+        entries = [{'o_num': 0}] + [{'o_num': i, 'o_gen': 0, 'abs_pos': i * 10} for i in range(1, 3000)]
+        idx = pdf.RevisionIndex(entries)
+        new_idx = idx.copy()
+        new_idx.append(None)
+        new_idx[5] = None
+        self.assertEqual(new_idx.unshared(idx), list(range(1, 1024)) + list(range(2048, 3001)))
+        self.assertEqual(new_idx.pop(), None)
+        self.assertEqual(list(idx), entries)